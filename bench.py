@@ -0,0 +1,449 @@
+"""Offline benchmark of the utils helpers and the end-to-end generate path.
+
+The generate path is driven through app.py itself (Streamlit's AppTest harness),
+so image loading, the quota check and single-flight are included.
+
+Runs against the Postgres configured through the usual DB_* variables (use a
+scratch database), seeded with synthetic papers whose codes start with "99",
+and a local stub of the Anthropic Messages API with configurable latency.
+
+Also records cold-import times (`-X importtime`) of the app modules.
+
+Usage:
+    python bench.py [--papers 200] [--hits 50] [--misses 10] [--ttft 0.5] [--tokens-per-s 200]
+                    [--output bench_baseline.json] [--compare previous.json]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+import statistics
+import subprocess
+import threading
+import argparse
+import datetime
+import base64
+import random
+import json
+import sys
+import time
+import os
+
+bench_prefix = "99"
+stub_response = (
+    "<summary>A synthetic paper about benchmarking dashboards.</summary>\n"
+    "<script>\n"
+    + "\n".join(
+        f"const Panel{i} = () => React.createElement(Card, null, "
+        f"React.createElement(CardContent, null, 'Finding {i}'));"
+        for i in range(40)
+    )
+    + "\nReactDOM.render(React.createElement(Panel0), document.getElementById('root'));\n"
+    "</script>"
+)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal Anthropic Messages endpoint that streams a canned dashboard."""
+
+    ttft = 0.5
+    tokens_per_s = 200.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send_event(self, event: str, data: dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt_tokens = sum(len(str(m["content"])) for m in body["messages"]) // 4
+        tokens = [stub_response[i:i + 4] for i in range(0, len(stub_response), 4)]
+        message = {
+            "id": "msg_bench",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": prompt_tokens, "output_tokens": 0},
+        }
+        time.sleep(self.ttft)
+
+        if not body.get("stream"):
+            time.sleep(len(tokens) / self.tokens_per_s)
+            message.update(
+                content=[{"type": "text", "text": stub_response}],
+                stop_reason="end_turn",
+                usage={"input_tokens": prompt_tokens, "output_tokens": len(tokens)},
+            )
+            payload = json.dumps(message).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self._send_event("message_start", {"type": "message_start", "message": message})
+        self._send_event(
+            "content_block_start",
+            {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        )
+        for token in tokens:
+            self._send_event(
+                "content_block_delta",
+                {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}},
+            )
+            time.sleep(1 / self.tokens_per_s)
+        self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._send_event(
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": len(tokens)},
+            },
+        )
+        self._send_event("message_stop", {"type": "message_stop"})
+
+
+def start_stub_llm(ttft: float, tokens_per_s: float) -> str:
+    """Start the stub LLM server on a free port and return its base URL."""
+    StubLLMHandler.ttft = ttft
+    StubLLMHandler.tokens_per_s = tokens_per_s
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_code(i: int) -> str:
+    return f"{bench_prefix}01.{i:05d}"
+
+
+## A 1x1 PNG standing in for each synthetic paper's image.
+bench_png = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+def seed_images(directory: str, n_papers: int):
+    """Write an image per synthetic paper for the local image origin."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n_papers):
+        with open(os.path.join(directory, f"{bench_code(i)}.png"), "wb") as f:
+            f.write(bench_png)
+
+
+def seed(u, n_papers: int):
+    """Create the tables if needed and insert synthetic papers, notes, summaries and dashboards."""
+    from sqlalchemy import text
+    import migrate
+
+    rng = random.Random(0)
+    with u.get_engine().begin() as conn:
+        for ddl in [
+            "CREATE TABLE IF NOT EXISTS arxiv_details (arxiv_code TEXT PRIMARY KEY, title TEXT)",
+            "CREATE TABLE IF NOT EXISTS recursive_summaries (arxiv_code TEXT PRIMARY KEY, summary TEXT)",
+            "CREATE TABLE IF NOT EXISTS summary_notes (arxiv_code TEXT, level INTEGER, summary TEXT, tokens INTEGER)",
+            "CREATE TABLE IF NOT EXISTS arxiv_dashboards (arxiv_code TEXT, tstp TIMESTAMP, script_content TEXT, summary TEXT, scratchpad TEXT)",
+            "CREATE TABLE IF NOT EXISTS dashboard_requests (request_id TEXT, tstp TIMESTAMP, arxiv_code TEXT)",
+        ]:
+            conn.execute(text(ddl))
+        ## The migrations below lock and rewrite whole tables, so refuse anything but a scratch DB.
+        real_rows = conn.execute(
+            text(
+                """
+                SELECT (SELECT COUNT(*) FROM arxiv_details WHERE arxiv_code NOT LIKE :prefix)
+                     + (SELECT COUNT(*) FROM arxiv_dashboards WHERE arxiv_code NOT LIKE :prefix)
+                """
+            ),
+            {"prefix": f"{bench_prefix}%"},
+        ).scalar()
+    if real_rows:
+        raise SystemExit(
+            f"The database holds {real_rows} non-synthetic paper/dashboard rows; "
+            "run bench.py against a scratch database (see the DB_* variables)."
+        )
+    migrate.migrate_quota()
+    migrate.migrate_versions()
+    cleanup(u)
+
+    papers, summaries, notes, dashboards = [], [], [], []
+    for i in range(n_papers):
+        code = bench_code(i)
+        papers.append({"arxiv_code": code, "title": f"Synthetic paper {i}"})
+        summaries.append({"arxiv_code": code, "summary": "Lorem ipsum dolor sit amet. " * 80})
+        for level in range(1, 5):
+            tokens = int(6000 / level * rng.uniform(0.8, 1.2))
+            notes.append({"arxiv_code": code, "level": level, "summary": "Note text. " * (tokens // 3), "tokens": tokens})
+        ## Even papers have a cached dashboard (hit path), odd ones don't (miss path).
+        if i % 2 == 0:
+            dashboards.append({
+                "arxiv_code": code,
+                "script": stub_response.split("<script>")[1].split("</script>")[0],
+                "summary": "A synthetic paper about benchmarking dashboards.",
+                "scratchpad": "",
+            })
+    with u.get_engine().begin() as conn:
+        conn.execute(text("INSERT INTO arxiv_details VALUES (:arxiv_code, :title)"), papers)
+        conn.execute(text("INSERT INTO recursive_summaries VALUES (:arxiv_code, :summary)"), summaries)
+        conn.execute(text("INSERT INTO summary_notes VALUES (:arxiv_code, :level, :summary, :tokens)"), notes)
+    u.save_arxiv_dashboard_scripts(dashboards)
+
+
+def cleanup(u):
+    """Remove every synthetic row."""
+    from sqlalchemy import text
+
+    with u.get_engine().begin() as conn:
+        for table in [
+            "arxiv_details", "recursive_summaries", "summary_notes",
+            "arxiv_dashboards", "arxiv_dashboard_current", "dashboard_requests",
+        ]:
+            conn.execute(text(f"DELETE FROM {table} WHERE arxiv_code LIKE :prefix"), {"prefix": f"{bench_prefix}%"})
+
+
+def summarize(samples: list) -> dict:
+    """Latency percentiles in milliseconds."""
+    ms = sorted(s * 1000 for s in samples)
+    pct = lambda q: ms[min(len(ms) - 1, int(round(q * (len(ms) - 1))))]
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+    }
+
+
+def measure(samples: dict, stage: str, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    samples.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def bench_helpers(u, n_papers: int, iterations: int) -> dict:
+    """Time each utils helper against the synthetic data."""
+    samples = {}
+    today = datetime.date.today().isoformat()
+    for i in range(iterations):
+        code = bench_code((2 * i) % n_papers)
+        measure(samples, "refresh_arxiv_title_catalog_full", u.refresh_arxiv_title_catalog, full=True)
+        measure(samples, "refresh_arxiv_title_catalog_delta", u.refresh_arxiv_title_catalog)
+        measure(samples, "get_arxiv_title", u.get_arxiv_title, code)
+        measure(samples, "get_recursive_summary", u.get_recursive_summary, code)
+        measure(samples, "get_extended_notes_level", u.get_extended_notes, code, level=2)
+        measure(samples, "get_extended_notes_tokens", u.get_extended_notes, code, expected_tokens=3000)
+        measure(samples, "get_extended_notes_default", u.get_extended_notes, code)
+        measure(samples, "get_arxiv_dashboard_script", u.get_arxiv_dashboard_script, code, "script_content")
+        measure(samples, "get_daily_arxiv_request_count", u.get_daily_arxiv_request_count, today)
+        measure(samples, "get_daily_generation_count", u.get_daily_generation_count, today)
+        measure(samples, "load_paper_context", u.load_paper_context, code)
+        measure(samples, "select_note_level", u.select_note_level, code, 3000)
+        measure(samples, "log_request", u.log_request, code)
+    measure(samples, "flush_request_log", u.flush_request_log)
+    return {stage: summarize(s) for stage, s in samples.items()}
+
+
+def bench_store(u, n_papers: int, iterations: int) -> dict:
+    """Time the PaperStore lookups with server-side prepared statements and with plain bound parameters."""
+    import store
+
+    results = {}
+    for mode, prepared in [("prepared", True), ("unprepared", False)]:
+        paper_store = store.PaperStore(u.get_engine, prepared=prepared)
+        samples = {}
+        for i in range(iterations):
+            code = bench_code((2 * i) % n_papers)
+            measure(samples, "get_recursive_summary", paper_store.get_recursive_summary, code)
+            measure(samples, "get_notes_tokens", paper_store.get_notes, code, expected_tokens=3000)
+            measure(samples, "get_dashboard_field", paper_store.get_dashboard_field, code, "script_content")
+            measure(samples, "load_paper_contexts", paper_store.load_paper_contexts, [code], 3000)
+        results[mode] = {stage: summarize(s) for stage, s in samples.items()}
+    return results
+
+
+@contextmanager
+def record_stages(samples: dict):
+    """Collect every `stage_duration_seconds` observation made while the block runs."""
+    import metrics as m
+
+    observe = m.observe
+
+    def recording_observe(name: str, value: float, **labels):
+        if name == "stage_duration_seconds":
+            samples.setdefault(labels["stage"], []).append(value)
+        observe(name, value, **labels)
+
+    m.observe = recording_observe
+    try:
+        yield
+    finally:
+        m.observe = observe
+
+
+def click_generate(code: str, title: str, timeout: float) -> float:
+    """Run app.py in Streamlit's test harness, pick a paper and click Generate; returns the click's wall time."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), default_timeout=timeout)
+    at.run()
+    at.selectbox[0].set_value(f"{code} - {title}")
+    at.run()
+    start = time.perf_counter()
+    at.button[0].click().run()
+    seconds = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"app.py failed for {code}: {at.exception[0].value}")
+    return seconds
+
+
+def bench_generate(u, r, n_papers: int, hits: int, misses: int, timeout: float = 300) -> dict:
+    """Time Generate clicks through the real app on the artifact-hit, row-hit and miss paths."""
+    titles = u.get_arxiv_title_dict()
+    hit_codes = [bench_code((2 * i) % n_papers) for i in range(hits)]
+    results = {}
+    for path, codes in [
+        ## Dashboard row stored, rendered page not cached: the generate_html path.
+        ("cache_hit", hit_codes),
+        ## Second click on the same papers: served from the artifact cache.
+        ("artifact_hit", hit_codes),
+        ("cache_miss", [bench_code((2 * i + 1) % n_papers) for i in range(misses)]),
+    ]:
+        samples = {}
+        with record_stages(samples):
+            for code in codes:
+                if path == "cache_hit":
+                    r.artifact_cache.invalidate(code)
+                samples.setdefault("total", []).append(click_generate(code, titles[code], timeout))
+        results[path] = {stage: summarize(s) for stage, s in samples.items()}
+    return results
+
+
+def measure_imports(modules: list, top: int = 10) -> dict:
+    """Cold-import each module in a fresh interpreter with `-X importtime`."""
+    report = {}
+    for module in modules:
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        wall = time.perf_counter() - start
+        packages = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split(":", 1)[1].split("|")
+            ## importtime indents nested imports by two spaces per level.
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            packages.append((int(cumulative), name.strip(), depth))
+        ## Matched by name, not depth 0: threads started at import (e.g. app.py's note-index
+        ## warm-up) interleave their own imports and shift the module's row.
+        own = next(((us, depth) for us, name, depth in packages if name == module), None)
+        report[module] = {
+            "ok": proc.returncode == 0,
+            "import_ms": round(own[0] / 1000, 3) if own is not None else None,
+            "process_wall_ms": round(wall * 1000, 3),
+            "heaviest": [
+                {"package": name, "cumulative_ms": round(us / 1000, 3)}
+                for us, name, depth in sorted(packages, reverse=True)
+                if own is not None and depth == own[1] + 1
+            ][:top],
+        }
+    return report
+
+
+def flatten(baseline: dict) -> dict:
+    """Map "section/path/stage" names to their stats."""
+    rows = {f"helpers/{stage}": stats for stage, stats in baseline["helpers"].items()}
+    for section in ["generate", "store"]:
+        for path, stages in baseline.get(section, {}).items():
+            rows.update({f"{section}/{path}/{stage}": stats for stage, stats in stages.items()})
+    return rows
+
+
+def compare_imports(baseline: dict, previous: dict):
+    """Print import-time changes against a previous baseline file."""
+    old, new = previous.get("imports", {}), baseline.get("imports", {})
+    for module in sorted(new.keys() & old.keys()):
+        if new[module]["import_ms"] is not None and old[module]["import_ms"] is not None:
+            delta = new[module]["import_ms"] - old[module]["import_ms"]
+            print(f"imports/{module}: {old[module]['import_ms']:.1f} -> {new[module]['import_ms']:.1f} ms ({delta:+.1f})")
+
+
+def compare(baseline: dict, previous: dict):
+    """Print p50/p95 changes against a previous baseline file."""
+    old, new = flatten(previous), flatten(baseline)
+    for name in sorted(new.keys() & old.keys()):
+        for pct in ["p50_ms", "p95_ms"]:
+            delta = new[name][pct] - old[name][pct]
+            print(f"{name} {pct}: {old[name][pct]:.2f} -> {new[name][pct]:.2f} ({delta:+.2f})")
+    compare_imports(baseline, previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the utils helpers and generate path.")
+    parser.add_argument("--papers", type=int, default=200, help="Synthetic papers to seed.")
+    parser.add_argument("--iterations", type=int, default=50, help="Iterations per helper.")
+    parser.add_argument("--hits", type=int, default=50, help="Cache-hit generate runs.")
+    parser.add_argument("--misses", type=int, default=10, help="Cache-miss generate runs.")
+    parser.add_argument("--ttft", type=float, default=0.5, help="Stub LLM time to first token (s).")
+    parser.add_argument("--tokens-per-s", type=float, default=200, help="Stub LLM output speed.")
+    parser.add_argument("--output", default="bench_baseline.json")
+    parser.add_argument("--compare", help="Previous baseline file to diff against.")
+    parser.add_argument("--keep-data", action="store_true", help="Leave the synthetic rows in place.")
+    args = parser.parse_args()
+
+    os.environ["ANTHROPIC_BASE_URL"] = start_stub_llm(args.ttft, args.tokens_per_s)
+    os.environ.setdefault("ANTHROPIC_API_KEY", "bench")
+    os.environ.setdefault("ARTIFACT_CACHE_DIR", ".bench_artifact_cache")
+    os.environ.setdefault("IMAGE_ORIGIN", ".bench_images")
+    os.environ.setdefault("IMAGE_CACHE_DIR", ".bench_image_cache")
+    ## The generate runs go through the app's quota, which must not be what is measured.
+    os.environ.setdefault("QUOTA_DAILY_LIMIT", "1000000")
+    os.environ.setdefault("QUOTA_PER_MINUTE", "1000000")
+    seed_images(os.environ["IMAGE_ORIGIN"], args.papers)
+
+    ## Measured first, in fresh interpreters, so they see a cold start.
+    imports = measure_imports(["utils", "render", "instruct", "generate", "app"])
+
+    import utils as u
+    import render as r
+
+    seed(u, args.papers)
+    try:
+        baseline = {
+            "meta": {
+                "tstp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "git_rev": subprocess.run(
+                    ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+                ).stdout.strip(),
+                "params": vars(args),
+            },
+            "helpers": bench_helpers(u, args.papers, args.iterations),
+            "store": bench_store(u, args.papers, args.iterations),
+            "generate": bench_generate(u, r, args.papers, args.hits, args.misses),
+            "pool": {k: v for k, v in u.get_pool_stats().items() if k != "status"},
+            "imports": imports,
+        }
+    finally:
+        if not args.keep_data:
+            cleanup(u)
+
+    with open(args.output, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(baseline, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
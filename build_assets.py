@@ -0,0 +1,145 @@
+"""Vendor the dashboard front-end runtime and precompile Tailwind to static CSS.
+
+Usage:
+    python build_assets.py [--skip-db]      # fetch assets, compile CSS, write manifest
+    python build_assets.py serve [--port]   # serve assets with long-lived cache headers
+
+Then run the app with DASHBOARD_ASSETS=inline, or with DASHBOARD_ASSETS=local and
+DASHBOARD_ASSETS_URL set to the `serve` origin (e.g. http://localhost:8502). Besides the
+classes of stored scripts, the CSS includes a safelist of common utilities so dashboards
+generated after the build still render; re-run it (`pregenerate.py --build-assets` does)
+to pick up anything rarer.
+"""
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+import urllib.request
+import subprocess
+import argparse
+import tempfile
+import hashlib
+import json
+import os
+
+import render as r
+
+tailwind_version = "3.4.4"
+
+## Utilities generated dashboards commonly use, compiled in whether or not a stored script has them yet.
+tailwind_colors = "slate|gray|zinc|neutral|stone|red|orange|amber|yellow|lime|green|emerald|teal|cyan|sky|blue|indigo|violet|purple|fuchsia|pink|rose"
+tailwind_safelist = [
+    (rf"^(bg|text|border|from|via|to)-({tailwind_colors})-(50|100|200|300|400|500|600|700|800|900)$", ["hover"]),
+    (r"^(bg|text|border)-(white|black|transparent)$", ["hover"]),
+    (r"^-?(p|px|py|pt|pr|pb|pl|m|mx|my|mt|mr|mb|ml|gap|gap-x|gap-y|space-x|space-y)-(0|0\.5|1|1\.5|2|2\.5|3|4|5|6|8|10|12|16)$", ["md"]),
+    (r"^(w|h|min-h|max-h)-(full|screen|auto|1/2|1/3|2/3|1/4|3/4|4|6|8|10|12|16|20|24|32|48|64|72|80|96)$", ["md"]),
+    (r"^max-w-(xs|sm|md|lg|xl|2xl|3xl|4xl|5xl|6xl|7xl|full)$", []),
+    (r"^text-(xs|sm|base|lg|xl|2xl|3xl|4xl|5xl|left|center|right|justify)$", ["md"]),
+    (r"^font-(light|normal|medium|semibold|bold|extrabold|sans|serif|mono)$", []),
+    (r"^(grid-cols|col-span)-(1|2|3|4|5|6|12)$", ["sm", "md", "lg"]),
+    (r"^(flex|inline-flex|grid|block|inline-block|hidden|flex-row|flex-col|flex-wrap|flex-1|grow|shrink-0)$", ["sm", "md", "lg"]),
+    (r"^(items|content)-(start|center|end|stretch|baseline)$", ["md"]),
+    (r"^justify-(start|center|end|between|around|evenly)$", ["md"]),
+    (r"^rounded(-(t|b|l|r))?(-(none|sm|md|lg|xl|2xl|3xl|full))?$", []),
+    (r"^shadow(-(sm|md|lg|xl|2xl|inner|none))?$", ["hover"]),
+    (r"^border(-(t|b|l|r))?(-(0|2|4|8))?$", []),
+    (r"^(leading-(none|tight|snug|normal|relaxed|loose)|tracking-(tight|normal|wide))$", []),
+    (r"^(overflow|overflow-x|overflow-y)-(auto|hidden|scroll)$", []),
+    (r"^(relative|absolute|fixed|sticky|inset-0|top-0|left-0|right-0|bottom-0|z-10|z-20|z-50)$", []),
+    (r"^(list-(disc|decimal|inside)|underline|italic|uppercase|truncate|whitespace-nowrap|cursor-pointer)$", []),
+    (r"^(transition|transition-all|duration-(150|200|300|500)|opacity-(50|75|100)|scale-105)$", ["hover"]),
+]
+
+
+def fetch_vendor_assets():
+    """Download the pinned runtime libraries into the vendor directory."""
+    for name, url in r.vendor_assets.items():
+        print(f"Fetching {url}")
+        with urllib.request.urlopen(url) as response:
+            body = response.read()
+        with open(os.path.join(r.assets_dir, name), "wb") as f:
+            f.write(body)
+
+
+def compile_tailwind(scripts: list):
+    """Compile the Tailwind classes used by the template and stored scripts to minified CSS."""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "template.html"), "w") as f:
+            f.write(r.html_template)
+        for i, script in enumerate(scripts):
+            with open(os.path.join(tmp, f"script_{i}.js"), "w") as f:
+                f.write(script)
+        input_css = os.path.join(tmp, "input.css")
+        with open(input_css, "w") as f:
+            f.write("@tailwind base;\n@tailwind components;\n@tailwind utilities;\n")
+        config = os.path.join(tmp, "tailwind.config.js")
+        with open(config, "w") as f:
+            safelist = []
+            for pattern, variants in tailwind_safelist:
+                ## Written as JS regex literals, so "/" (as in w-1/2) must be escaped.
+                pattern = pattern.replace("/", "\\/")
+                safelist.append(f"{{pattern: /{pattern}/, variants: {json.dumps(variants)}}}")
+            f.write("module.exports = {content: [], safelist: [\n    " + ",\n    ".join(safelist) + "\n]};\n")
+        subprocess.run(
+            [
+                "npx", "--yes", f"tailwindcss@{tailwind_version}",
+                "-c", config,
+                "-i", input_css,
+                "-o", os.path.join(r.assets_dir, r.tailwind_css),
+                "--content", os.path.join(tmp, "*.{html,js}"),
+                "--minify",
+            ],
+            check=True,
+        )
+
+
+def write_manifest():
+    """Record a content hash per asset, used to version their URLs."""
+    manifest = {}
+    for name in [*r.vendor_assets, r.tailwind_css]:
+        with open(os.path.join(r.assets_dir, name), "rb") as f:
+            manifest[name] = hashlib.sha256(f.read()).hexdigest()[:12]
+    with open(os.path.join(r.assets_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ImmutableAssetHandler(SimpleHTTPRequestHandler):
+    """Static handler that marks content-hashed assets as cacheable for a year."""
+
+    def end_headers(self):
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+
+def build(skip_db: bool = False):
+    """Fetch the vendored runtime, compile Tailwind for the stored scripts and write the manifest."""
+    os.makedirs(r.assets_dir, exist_ok=True)
+    fetch_vendor_assets()
+    scripts = []
+    if not skip_db:
+        import utils as u
+        scripts = u.get_all_dashboard_scripts()
+    compile_tailwind(scripts)
+    for name, digest in write_manifest().items():
+        size = os.path.getsize(os.path.join(r.assets_dir, name))
+        print(f"{name}: {size / 1024:.1f} KB ({digest})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or serve vendored dashboard assets.")
+    parser.add_argument("command", nargs="?", default="build", choices=["build", "serve"])
+    parser.add_argument("--skip-db", action="store_true", help="Only scan the template for Tailwind classes.")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        handler = partial(ImmutableAssetHandler, directory=r.assets_dir)
+        print(f"Serving {r.assets_dir} on port {args.port}")
+        ThreadingHTTPServer(("", args.port), handler).serve_forever()
+        return
+
+    build(skip_db=args.skip_db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Shared database engine and the dashboard text codecs.
+
+Kept apart from utils so the data-access layer (store.py) and utils can both
+import it without a cycle; utils re-exports these names.
+"""
+from sqlalchemy import create_engine
+import streamlit as st
+import threading
+import zlib
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+db_params = {}
+try:
+    db_params = {
+        "dbname": os.environ["DB_NAME"],
+        "user": os.environ["DB_USER"],
+        "password": os.environ["DB_PASS"],
+        "host": os.environ["DB_HOST"],
+        "port": os.environ["DB_PORT"],
+    }
+except:
+    db_params = {**st.secrets["postgres"]}
+
+
+database_url = f"postgresql+psycopg2://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['dbname']}"
+
+pool_params = {
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+    "max_overflow": int(os.environ.get("DB_POOL_MAX_OVERFLOW", 5)),
+    "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") != "0",
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Get the process-wide pooled engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(database_url, **pool_params)
+    return _engine
+
+
+def get_pool_stats() -> dict:
+    """Get connection pool statistics for the shared engine."""
+    pool = get_engine().pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool_params["max_overflow"],
+        "status": pool.status(),
+    }
+
+
+## Storage codec for new dashboard rows: "none" (plain text columns), "gzip" or "zstd".
+dashboard_codec = os.environ.get("DASHBOARD_CODEC", "none")
+dashboard_text_columns = ["script_content", "summary", "scratchpad"]
+
+
+def compress_text(value: str, codec: str) -> bytes:
+    """Compress a text field with the given codec."""
+    if value is None:
+        return None
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("The zstd codec requires the `zstandard` package.")
+        return zstandard.ZstdCompressor(level=10).compress(value.encode())
+    return zlib.compress(value.encode(), 9)
+
+
+def decompress_text(blob: bytes, codec: str) -> str:
+    """Decompress a text field stored with the given codec."""
+    if blob is None:
+        return None
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("The zstd codec requires the `zstandard` package.")
+        return zstandard.ZstdDecompressor().decompress(bytes(blob)).decode()
+    return zlib.decompress(bytes(blob)).decode()
+
+
+def decode_dashboard_fields(codec: str, plain: dict, compressed: dict) -> dict:
+    """Pick each field's plain or compressed column depending on the row codec."""
+    if not codec:
+        return plain
+    return {col: decompress_text(compressed.get(col), codec) for col in plain}
@@ -0,0 +1,181 @@
+"""Export every stored dashboard as a standalone HTML page, plus a searchable index.
+
+Incremental: a manifest in the output directory records each page's `tstp`,
+title and content hash, so only new or changed dashboards are re-rendered (all
+of them when the template or assets change, or with --full). Pages are rendered
+in a process pool. The output can be served by any static file server or CDN.
+
+Usage:
+    python export.py [--output site] [--workers 4] [--batch-size 200] [--full]
+
+With DASHBOARD_ASSETS=local, vendored assets are copied to <output>/vendor; set
+DASHBOARD_ASSETS_URL to where that directory is served (e.g. "/vendor").
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import shutil
+import html
+import json
+import time
+import os
+
+import utils as u
+import render as r
+
+manifest_name = "manifest.json"
+
+index_template = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>LLM Arxiv Paper Dashboards</title>
+<style>
+    body {{ font-family: Arial, sans-serif; background-color: #FFF5E6; max-width: 960px; margin: 0 auto; padding: 24px; }}
+    input {{ width: 100%; padding: 10px; font-size: 16px; box-sizing: border-box; margin-bottom: 16px; }}
+    li {{ margin: 6px 0; }}
+    .code {{ color: #888; font-size: 13px; }}
+</style>
+</head>
+<body>
+    <h1>LLM Arxiv Paper Dashboards</h1>
+    <input id="search" type="search" placeholder="Search {count} dashboards by title or arxiv code..." autofocus>
+    <ul id="pages">
+{items}
+    </ul>
+<script>
+    const items = Array.from(document.querySelectorAll("#pages li"));
+    document.getElementById("search").addEventListener("input", (e) => {{
+        const terms = e.target.value.toLowerCase().split(/\\s+/).filter(Boolean);
+        for (const item of items) {{
+            const text = item.dataset.search;
+            item.style.display = terms.every((t) => text.includes(t)) ? "" : "none";
+        }}
+    }});
+</script>
+</body>
+</html>"""
+
+
+def load_manifest(output_dir: str) -> dict:
+    """Load the previous export's manifest (empty on the first run)."""
+    try:
+        with open(os.path.join(output_dir, manifest_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"template_hash": None, "pages": {}}
+
+
+def write_atomic(path: str, body: str):
+    """Write a file through a temporary path so servers never see partial pages."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def render_page(output_dir: str, dashboard: dict, known_hash: str) -> tuple:
+    """Render one dashboard page (in a worker process); returns (content_hash, written)."""
+    title = dashboard["title"] or dashboard["arxiv_code"]
+    content_hash = r.get_content_hash(title, dashboard["summary"], dashboard["script_content"])
+    path = os.path.join(output_dir, f"{dashboard['arxiv_code']}.html")
+    if content_hash == known_hash and os.path.exists(path):
+        return content_hash, False
+    page = r.render_dashboard_html(title, dashboard["summary"], dashboard["script_content"])
+    write_atomic(path, page)
+    return content_hash, True
+
+
+def build_index(output_dir: str, pages: dict):
+    """Write index.html listing every exported page, newest first, with client-side search."""
+    items = []
+    for code, page in sorted(pages.items(), key=lambda item: item[1]["tstp"], reverse=True):
+        title = page["title"] or code
+        items.append(
+            f'        <li data-search="{html.escape((title + " " + code).lower())}">'
+            f'<a href="{code}.html">{html.escape(title)}</a> <span class="code">arxiv:{code}</span></li>'
+        )
+    write_atomic(
+        os.path.join(output_dir, "index.html"),
+        index_template.format(count=len(pages), items="\n".join(items)),
+    )
+
+
+def copy_assets(output_dir: str):
+    """Copy vendored front-end assets next to the pages when they are loaded locally."""
+    if r.asset_mode == "local" and os.path.isdir(r.assets_dir):
+        shutil.copytree(r.assets_dir, os.path.join(output_dir, "vendor"), dirs_exist_ok=True)
+
+
+def export(output_dir: str, workers: int, batch_size: int, full: bool = False) -> dict:
+    """Render new and changed dashboards and rebuild the index; returns counts."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    if full or manifest["template_hash"] != r.template_hash:
+        manifest = {"template_hash": r.template_hash, "pages": {}}
+    pages = manifest["pages"]
+
+    versions = u.get_dashboard_versions()
+    stale = [
+        code for code, (tstp, title) in versions.items()
+        if code not in pages or pages[code]["tstp"] != tstp or pages[code]["title"] != title
+    ]
+    counts = {"total": len(versions), "stale": len(stale), "written": 0, "unchanged": 0, "removed": 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(stale), batch_size):
+            dashboards = u.load_dashboards(stale[i : i + batch_size])
+            futures = {
+                code: pool.submit(
+                    render_page, output_dir, {"arxiv_code": code, **dashboard}, pages.get(code, {}).get("content_hash")
+                )
+                for code, dashboard in dashboards.items()
+            }
+            for code, future in futures.items():
+                try:
+                    content_hash, written = future.result()
+                except Exception as e:
+                    print(f"Error in exporting {code}: {e}")
+                    continue
+                counts["written" if written else "unchanged"] += 1
+                pages[code] = {
+                    "tstp": dashboards[code]["tstp"],
+                    "title": dashboards[code]["title"],
+                    "content_hash": content_hash,
+                }
+            ## Save progress per batch, so an interrupted export resumes where it stopped.
+            write_atomic(os.path.join(output_dir, manifest_name), json.dumps(manifest))
+
+    for code in set(pages) - set(versions):
+        pages.pop(code)
+        try:
+            os.remove(os.path.join(output_dir, f"{code}.html"))
+        except FileNotFoundError:
+            pass
+        counts["removed"] += 1
+
+    write_atomic(os.path.join(output_dir, manifest_name), json.dumps(manifest))
+    build_index(output_dir, pages)
+    copy_assets(output_dir)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored dashboards as a static site.")
+    parser.add_argument("--output", default="site", help="Output directory.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Render processes.")
+    parser.add_argument("--batch-size", type=int, default=200, help="Dashboards loaded from the DB at a time.")
+    parser.add_argument("--full", action="store_true", help="Re-render every dashboard.")
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = export(args.output, args.workers, args.batch_size, args.full)
+    print(
+        f"Exported {counts['written']} of {counts['total']} dashboards to {args.output} "
+        f"({counts['stale']} stale, {counts['unchanged']} unchanged, {counts['removed']} removed) "
+        f"in {time.time() - start:.1f}s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import time
+import os
+
+import utils as u
+import metrics as m
+import render as r
+import prompts as p
+from instruct import stream_continued_query, stream_hedged_query, truncated_stop_reasons, StreamReset
+
+dashboard_llm_model = "claude-3-5-sonnet-20240620"
+dashboard_temperature = 0.7
+dashboard_max_rounds = int(os.environ.get("DASHBOARD_MAX_ROUNDS", 3))
+## Optional hedge: also ask this model if the primary has no first token after the delay.
+dashboard_hedge_model = os.environ.get("DASHBOARD_HEDGE_MODEL")
+dashboard_hedge_delay = float(os.environ.get("DASHBOARD_HEDGE_DELAY", 8))
+## How long to wait for another replica's generation, retrying its lock in between.
+dashboard_wait_timeout = float(os.environ.get("DASHBOARD_WAIT_TIMEOUT", 180))
+dashboard_lock_retry_interval = float(os.environ.get("DASHBOARD_LOCK_RETRY_INTERVAL", 10))
+
+## Token budget for the paper notes in the prompt, shrunk when the model runs slow.
+notes_token_budget = int(os.environ.get("DASHBOARD_NOTES_BUDGET", 3000))
+min_notes_token_budget = int(os.environ.get("DASHBOARD_MIN_NOTES_BUDGET", 1000))
+target_llm_latency = float(os.environ.get("DASHBOARD_TARGET_LATENCY", 60))
+model_context_tokens = {
+    "claude-3-5-sonnet-20240620": 200_000,
+    "claude-3-haiku-20240307": 200_000,
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+}
+reserved_tokens = 4096 + len(p.artifacts_user_prompt) // 4
+observed_latency = {}
+
+
+def observe_llm_latency(llm_model: str, seconds: float, alpha: float = 0.2):
+    """Fold a generation's wall time into the model's moving average."""
+    previous = observed_latency.get(llm_model, seconds)
+    observed_latency[llm_model] = (1 - alpha) * previous + alpha * seconds
+
+
+def get_notes_token_budget(llm_model: str = dashboard_llm_model) -> int:
+    """Get the notes budget for a model, bounded by its context and scaled down by observed latency."""
+    budget = min(notes_token_budget, model_context_tokens.get(llm_model, 8192) - reserved_tokens)
+    latency = observed_latency.get(llm_model)
+    if latency and latency > target_llm_latency:
+        budget = int(budget * target_llm_latency / latency)
+    return max(min_notes_token_budget, budget)
+
+
+def timed(timings, stage, fn, *args, **kwargs):
+    """Run a function, observing its wall time as stage "generate.<stage>" (and under `stage` in `timings`)."""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        m.observe("stage_duration_seconds", seconds, stage=f"generate.{stage}")
+        if timings is not None:
+            timings[stage] = seconds
+
+
+def stream_dashboard_response(title: str, content: str, on_delta=None) -> dict:
+    """Stream the dashboard generation, calling `on_delta` with the text received so far.
+
+    Truncated output is continued from where it stopped (see `stream_continued_query`).
+    Returns the final result, with the `model` that produced it.
+    """
+    user_prompt = p.artifacts_user_prompt.format(title=title, content=content)
+    res_str = ""
+    if dashboard_hedge_model:
+        stream = stream_hedged_query(
+            p.artifacts_system_prompt,
+            user_prompt,
+            llm_model=dashboard_llm_model,
+            hedge_model=dashboard_hedge_model,
+            hedge_delay=dashboard_hedge_delay,
+            temperature=dashboard_temperature,
+            max_rounds=dashboard_max_rounds,
+        )
+    else:
+        stream = stream_continued_query(
+            p.artifacts_system_prompt,
+            user_prompt,
+            llm_model=dashboard_llm_model,
+            temperature=dashboard_temperature,
+            max_rounds=dashboard_max_rounds,
+        )
+    while True:
+        try:
+            delta = next(stream)
+        except StopIteration as stop:
+            result = stop.value
+            break
+        ## A hedged stream switching requests replaces the text instead of extending it.
+        res_str = str(delta) if isinstance(delta, StreamReset) else res_str + delta
+        if on_delta:
+            on_delta(res_str)
+
+    if result["stop_reason"] in truncated_stop_reasons:
+        print(f"Dashboard still truncated after {result['rounds']} rounds.")
+    return {"model": dashboard_llm_model, **result}
+
+
+def parse_dashboard_response(res_str: str):
+    """Extract the summary and script sections from a generated response."""
+    summary = res_str.split("<summary>")[1].split("</summary>")[0].strip()
+    script = res_str.split("<script>")[1].split("</script>")[0].strip()
+    return summary, script
+
+
+def generate_dashboard(arxiv_code, title, content, on_delta=None, on_wait=None, timings=None, quota=None):
+    """Generate and save a dashboard, deferring to another replica while it holds the lock.
+
+    While waiting, the lock is retried every `dashboard_lock_retry_interval` seconds,
+    so a replica whose generation failed is taken over instead of waited out. If a
+    `quota` limiter is given, one generation is taken from it before calling the LLM.
+    """
+    deadline = time.time() + dashboard_wait_timeout
+    while True:
+        with u.dashboard_generation_lock(arxiv_code) as acquired:
+            if acquired:
+                return generate_locked_dashboard(arxiv_code, title, content, on_delta, timings, quota)
+        ## Wait outside the lock context, so no pooled connection is held meanwhile.
+        if on_wait:
+            on_wait()
+        result = timed(
+            timings, "wait_for_dashboard", u.wait_for_dashboard, arxiv_code,
+            timeout=min(dashboard_lock_retry_interval, max(0.0, deadline - time.time())),
+        )
+        if result is not None:
+            return result
+        if time.time() >= deadline:
+            raise TimeoutError(f"Timed out waiting for dashboard {arxiv_code}.")
+
+
+def generate_locked_dashboard(arxiv_code, title, content, on_delta=None, timings=None, quota=None):
+    """Generate and save a dashboard while holding its generation lock."""
+    ## Another replica may have finished between our cache check and taking the lock.
+    script = u.get_arxiv_dashboard_script(arxiv_code, "script_content")
+    if script:
+        return u.get_arxiv_dashboard_script(arxiv_code, "summary"), script
+
+    if quota:
+        quota.acquire()
+    start = time.time()
+    result = timed(timings, "llm_stream", stream_dashboard_response, title, content, on_delta)
+    ## Charged to the model that answered, which differs from the primary when a hedge won.
+    observe_llm_latency(result["model"], time.time() - start)
+    summary, script = parse_dashboard_response(result["text"])
+    scratchpad = ""
+    timed(timings, "save_arxiv_dashboard_script", u.save_arxiv_dashboard_script, arxiv_code, summary, scratchpad, script)
+    r.artifact_cache.invalidate(arxiv_code)
+    return summary, script
@@ -0,0 +1,268 @@
+"""Paper image service: fetch each PNG once, cache resized variants, serve them with cache headers.
+
+The origin is pluggable: an HTTP(S) base URL (the S3 bucket by default) or a
+local directory of `<arxiv_code>.png` files (IMAGE_ORIGIN). Resizing and WebP
+recompression need Pillow; without it the original PNG is cached as-is.
+
+Usage:
+    python images.py serve [--port 8503]   # serve /img/<arxiv_code>.<ext>?w=<width>
+
+Then set IMAGE_SERVICE_URL for the app to link images through the service.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+import importlib.util
+import urllib.request
+import urllib.error
+import threading
+import argparse
+import hashlib
+import io
+import os
+import re
+
+import metrics as m
+import utils as u
+
+## Pillow is imported on the first resize; only check that it is installed here.
+has_pillow = importlib.util.find_spec("PIL") is not None
+
+content_types = {"webp": "image/webp", "png": "image/png", "jpeg": "image/jpeg"}
+image_path_pattern = re.compile(r"^/img/(\d{4}\.\d{4,5})\.(webp|png|jpeg)$")
+
+
+class HTTPOrigin:
+    """Fetch original images from `<base_url>/<arxiv_code>.png`."""
+
+    def __init__(self, base_url: str, timeout: float = 10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def fetch(self, arxiv_code: str):
+        """Get the original image bytes, or None if the origin has none."""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/{arxiv_code}.png", timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code in (403, 404):
+                return None
+            raise
+
+
+class LocalDirOrigin:
+    """Read original images from `<directory>/<arxiv_code>.png` (e.g. in tests)."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, arxiv_code: str):
+        """Get the original image bytes, or None if the file does not exist."""
+        try:
+            with open(os.path.join(self.directory, f"{arxiv_code}.png"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def get_origin(origin: str):
+    """Build an origin from a base URL or a directory path."""
+    if origin.startswith(("http://", "https://")):
+        return HTTPOrigin(origin)
+    return LocalDirOrigin(origin)
+
+
+class ImageService:
+    """Size-bounded disk cache of resized paper images in front of an origin."""
+
+    def __init__(self, origin, directory: str, max_bytes: int, width: int, fmt: str = "webp", quality: int = 80):
+        self.origin = origin
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self.fmt = fmt if has_pillow else "png"
+        self.quality = quality
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, arxiv_code: str, width: int, fmt: str) -> str:
+        return os.path.join(self.directory, f"{arxiv_code}-w{width}.{fmt}")
+
+    def resize(self, original: bytes, width: int, fmt: str) -> bytes:
+        """Downscale to `width` (never up) and re-encode as `fmt`."""
+        if not has_pillow:
+            return original
+        from PIL import Image
+
+        with Image.open(io.BytesIO(original)) as img:
+            if img.width > width:
+                img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            if fmt == "jpeg" and img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, format=fmt.upper(), quality=self.quality, optimize=True)
+            return out.getvalue()
+
+    def _variant(self, width: int = None, fmt: str = None) -> tuple:
+        if not has_pillow:
+            ## Without Pillow there is only one variant: the original.
+            return self.width, "png"
+        return width or self.width, fmt or self.fmt
+
+    def get_cached(self, arxiv_code: str, width: int = None, fmt: str = None):
+        """Get a cached image variant as bytes, or None on a miss (never touches the origin)."""
+        path = self._path(arxiv_code, *self._variant(width, fmt))
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            m.inc("cache_requests_total", cache="image", result="miss")
+            return None
+        m.inc("cache_requests_total", cache="image", result="hit")
+        ## Touch for LRU ordering.
+        os.utime(path)
+        return body
+
+    @m.timer("images.get")
+    def get(self, arxiv_code: str, width: int = None, fmt: str = None):
+        """Get a paper's image variant as bytes, fetching and resizing it on a miss; None if the origin has none."""
+        width, fmt = self._variant(width, fmt)
+        body = self.get_cached(arxiv_code, width, fmt)
+        if body is not None:
+            return body
+        path = self._path(arxiv_code, width, fmt)
+        original = self.origin.fetch(arxiv_code)
+        if original is None:
+            return None
+        body = self.resize(original, width, fmt)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        m.inc("image_bytes_saved_total", len(original) - len(body))
+        self.evict()
+        return body
+
+    def evict(self):
+        """Delete least recently used variants until the cache fits in `max_bytes`."""
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".tmp"):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+
+image_service = ImageService(
+    get_origin(os.environ.get("IMAGE_ORIGIN", "https://llmpedia.s3.amazonaws.com")),
+    os.environ.get("IMAGE_CACHE_DIR", ".image_cache"),
+    max_bytes=int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    width=int(os.environ.get("IMAGE_WIDTH", 640)),
+    fmt=os.environ.get("IMAGE_FORMAT", "webp"),
+)
+image_service_url = os.environ.get("IMAGE_SERVICE_URL")
+image_max_age = int(os.environ.get("IMAGE_MAX_AGE", 7 * 86400))
+
+## Cache misses are filled off the request path.
+_warm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-warm")
+_warming = set()
+_warming_lock = threading.Lock()
+
+
+def _warm(arxiv_code: str):
+    try:
+        image_service.get(arxiv_code)
+    except Exception as e:
+        print(f"Error in caching image for {arxiv_code}: {e}")
+    finally:
+        with _warming_lock:
+            _warming.discard(arxiv_code)
+
+
+def warm_image(arxiv_code: str):
+    """Fetch and cache a paper's image in the background (once at a time per paper)."""
+    with _warming_lock:
+        if arxiv_code in _warming:
+            return
+        _warming.add(arxiv_code)
+    _warm_executor.submit(_warm, arxiv_code)
+
+
+def get_image(arxiv_code: str):
+    """Get something `st.image` can show without waiting on the origin.
+
+    Returns a service URL, cached bytes, or, on a miss, the origin link while the
+    cache is warmed in the background for the next view.
+    """
+    if image_service_url:
+        return f"{image_service_url.rstrip('/')}/img/{arxiv_code}.{image_service.fmt}?w={image_service.width}"
+    try:
+        body = image_service.get_cached(arxiv_code)
+        if body is not None:
+            return body
+        warm_image(arxiv_code)
+    except Exception as e:
+        print(f"Error in loading image for {arxiv_code}: {e}")
+    return u.get_img_link_for_blob(f"arxiv:{arxiv_code}")
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serve `/img/<arxiv_code>.<ext>?w=<width>` with cache headers and ETags."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = image_path_pattern.match(url.path)
+        if not match:
+            self.send_error(404)
+            return
+        arxiv_code, fmt = match.groups()
+        try:
+            width = min(int(parse_qs(url.query).get("w", [image_service.width])[0]), 2048)
+            body = image_service.get(arxiv_code, width, fmt)
+        except ValueError:
+            self.send_error(400)
+            return
+        except Exception as e:
+            print(f"Error in serving image for {arxiv_code}: {e}")
+            self.send_error(502)
+            return
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_types.get(fmt if has_pillow else "png"))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", f"public, max-age={image_max_age}")
+        self.send_header("ETag", etag)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve cached, resized paper images.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--port", type=int, default=8503)
+    args = parser.parse_args()
+
+    print(f"Serving images from {image_service.directory} on port {args.port}")
+    ThreadingHTTPServer(("", args.port), ImageHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
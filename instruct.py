@@ -1,32 +1,121 @@
-from typing import Type, Optional
-from pydantic import BaseModel
-import instructor
-from anthropic import Anthropic
-from openai import OpenAI
+from typing import Type, Optional, TYPE_CHECKING
+import threading
+import socket
+import queue
+import json
+import time
+import os
 
+import metrics as m
+import llm_cache as lc
 
+## The SDKs (instructor, anthropic, openai, httpx, pydantic) are imported on first use
+## so that importing this module stays cheap for processes that never call an LLM.
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+## Keep-alive limits for the HTTP pools shared by cached clients.
+http_limits = dict(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+
+_clients = {}
+_instructor_clients = {}
+_clients_lock = threading.Lock()
+## The StreamAborter of the hedged request running on this thread, if any.
+_stream_aborters = threading.local()
+
+
+def get_client(model_type: str, **settings):
+    """Get a cached client for a provider and settings (base_url, api_key, timeout, ...)."""
+    key = (model_type, tuple(sorted(settings.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            import httpx
+
+            http_client = httpx.Client(limits=httpx.Limits(**http_limits))
+            if model_type == "Anthropic":
+                from anthropic import Anthropic
+
+                client = Anthropic(http_client=http_client, **settings)
+            elif model_type == "OpenAI":
+                from openai import OpenAI
+
+                client = OpenAI(http_client=http_client, **settings)
+            else:
+                raise ValueError(f"Unsupported model type: {model_type}")
+            _clients[key] = client
+    return client
+
+
+def get_instructor_client(client):
+    """Get the cached instructor-patched wrapper for a client."""
+    import instructor
+    from anthropic import Anthropic
+
+    with _clients_lock:
+        patched = _instructor_clients.get(id(client))
+        if patched is None or patched[0] is not client:
+            if isinstance(client, Anthropic):
+                patched = (client, instructor.from_anthropic(client))
+            else:
+                patched = (client, instructor.from_openai(client))
+            _instructor_clients[id(client)] = patched
+    return patched[1]
+
+
+def close_clients():
+    """Close all cached clients and their connection pools."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _instructor_clients.clear()
+
+
+@m.timer("llm.run_instructor_query")
 def run_instructor_query(
     system_message: str,
     user_message: str,
-    model: Optional[Type[BaseModel]] = None,
+    model: Optional[Type["BaseModel"]] = None,
     llm_model: str = "claude-3-haiku-20240307",
     temperature: float = 0.5,
+    client_settings: Optional[dict] = None,
+    cache: bool = True,
 ):
-    """Run a query with the instructor API and get a structured response."""
+    """Run a query with the instructor API and get a structured response.
+
+    Responses are memoized in the LLM cache when it is enabled, unless `cache=False`.
+    """
+    key = None
+    if cache and lc.llm_cache:
+        key = lc.LLMCache.make_key(
+            kind="query",
+            system_message=system_message,
+            user_message=user_message,
+            llm_model=llm_model,
+            temperature=temperature,
+            response_model=(model.__qualname__, model.model_json_schema()) if model else None,
+        )
+        cached = lc.llm_cache.get(key, model)
+        if cached is not None:
+            return cached
+
     model_type = "OpenAI" if "gpt" in llm_model else "Anthropic"
     if model_type == "Anthropic":
-        client = Anthropic()
+        client = get_client(model_type, **(client_settings or {}))
         response = create_anthropic_message(
             client, system_message, user_message, model, llm_model, temperature
         )
     elif model_type == "OpenAI":
-        client = OpenAI()
+        client = get_client(model_type, **(client_settings or {}))
         response = create_openai_message(
             client, system_message, user_message, model, llm_model, temperature
         )
     else:
         raise ValueError(f"Unsupported model type: {model_type}")
 
+    if key:
+        lc.llm_cache.put(key, response)
     return response
 
 
@@ -34,6 +123,7 @@ def create_anthropic_message(
     client, system_message, user_message, model, llm_model, temperature
 ):
     """Create a message with the Anthropic client, with an optional Pydantic model."""
+    start = time.perf_counter()
     if model is None:
         response = client.messages.create(
             max_tokens=4096,
@@ -46,7 +136,7 @@ def create_anthropic_message(
         )
         answer = response.content[0].text
     else:
-        client = instructor.from_anthropic(client)
+        client = get_instructor_client(client)
         response = client.messages.create(
             max_tokens=4096,
             max_retries=3,
@@ -59,6 +149,13 @@ def create_anthropic_message(
             response_model=model,
         )
         answer = response
+        response = getattr(response, "_raw_response", None)
+    if response is not None:
+        usage = {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens,
+        }
+        m.record_llm_call(llm_model, usage, time.perf_counter() - start)
     return answer
 
 
@@ -66,6 +163,7 @@ def create_openai_message(
     client, system_message, user_message, model, llm_model, temperature
 ):
     """Create a message with the OpenAI client, with an optional Pydantic model."""
+    start = time.perf_counter()
     if model is None:
         response = client.chat.completions.create(
             model=llm_model,
@@ -77,7 +175,7 @@ def create_openai_message(
         )
         answer = response.choices[0].message.content
     else:
-        client = instructor.from_openai(client)
+        client = get_instructor_client(client)
         response = client.chat.completions.create(
             model=llm_model,
             temperature=temperature,
@@ -88,4 +186,461 @@ def create_openai_message(
             response_model=model,
         )
         answer = response
+        response = getattr(response, "_raw_response", None)
+    if response is not None and response.usage:
+        usage = {
+            "input_tokens": response.usage.prompt_tokens,
+            "output_tokens": response.usage.completion_tokens,
+        }
+        m.record_llm_call(llm_model, usage, time.perf_counter() - start)
     return answer
+
+
+def stream_instructor_query(
+    system_message: str,
+    user_message: str,
+    llm_model: str = "claude-3-haiku-20240307",
+    temperature: float = 0.5,
+    client_settings: Optional[dict] = None,
+    prefill: Optional[str] = None,
+):
+    """Stream a free-text query, yielding text deltas as they arrive.
+
+    If `prefill` is given the model continues from it as its own partial answer.
+    The generator's return value holds the `stop_reason` and token `usage`.
+    """
+    model_type = "OpenAI" if "gpt" in llm_model else "Anthropic"
+    if model_type == "Anthropic":
+        client = get_client(model_type, **(client_settings or {}))
+        stream = stream_anthropic_message(
+            client, system_message, user_message, llm_model, temperature, prefill
+        )
+    elif model_type == "OpenAI":
+        client = get_client(model_type, **(client_settings or {}))
+        stream = stream_openai_message(
+            client, system_message, user_message, llm_model, temperature, prefill
+        )
+    else:
+        raise ValueError(f"Unsupported model type: {model_type}")
+
+    result = yield from instrument_stream(stream, llm_model)
+    return result
+
+
+def instrument_stream(stream, llm_model: str):
+    """Re-yield a text stream, recording time to first token, throughput and usage."""
+    start = time.perf_counter()
+    ttft = None
+    with m.timer("llm.stream"):
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            yield delta
+    m.record_llm_call(llm_model, result["usage"], time.perf_counter() - start, ttft)
+    return result
+
+
+def stream_anthropic_message(
+    client, system_message, user_message, llm_model, temperature, prefill=None
+):
+    """Stream a message with the Anthropic client, yielding text deltas."""
+    messages = [{"role": "user", "content": user_message}]
+    if prefill:
+        messages.append({"role": "assistant", "content": prefill})
+    with client.messages.stream(
+        max_tokens=4096,
+        model=llm_model,
+        system=system_message,
+        temperature=temperature,
+        messages=messages,
+    ) as stream:
+        register_stream_abort(lambda: abort_response(stream.response))
+        for text in stream.text_stream:
+            yield text
+        response = stream.get_final_message()
+    return {
+        "stop_reason": response.stop_reason,
+        "usage": {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens,
+        },
+    }
+
+
+def stream_openai_message(
+    client, system_message, user_message, llm_model, temperature, prefill=None
+):
+    """Stream a message with the OpenAI client, yielding text deltas."""
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message},
+    ]
+    if prefill:
+        ## No native prefill: replay the partial answer and ask for the rest.
+        messages += [
+            {"role": "assistant", "content": prefill},
+            {"role": "user", "content": "Continue exactly where you left off, without repeating anything."},
+        ]
+    stream = client.chat.completions.create(
+        model=llm_model,
+        temperature=temperature,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    register_stream_abort(lambda: abort_response(stream.response))
+    stop_reason, usage = None, {}
+    for chunk in stream:
+        if chunk.usage:
+            usage = {
+                "input_tokens": chunk.usage.prompt_tokens,
+                "output_tokens": chunk.usage.completion_tokens,
+            }
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            stop_reason = choice.finish_reason
+        if choice.delta.content:
+            yield choice.delta.content
+    return {"stop_reason": stop_reason, "usage": usage}
+
+
+## Stop reasons that mean the output was cut off by the token limit.
+truncated_stop_reasons = {"max_tokens", "length"}
+
+
+def stream_continued_query(
+    system_message: str,
+    user_message: str,
+    llm_model: str = "claude-3-haiku-20240307",
+    temperature: float = 0.5,
+    client_settings: Optional[dict] = None,
+    max_rounds: int = 3,
+    cache: bool = True,
+):
+    """Stream a query, continuing truncated output with an assistant prefill for up to `max_rounds`.
+
+    The generator's return value holds the stitched `text`, the final `stop_reason`,
+    the summed token `usage` and the number of `rounds` used. A cached result is
+    yielded as a single delta.
+    """
+    key = None
+    if cache and lc.llm_cache:
+        key = lc.LLMCache.make_key(
+            kind="continued",
+            system_message=system_message,
+            user_message=user_message,
+            llm_model=llm_model,
+            temperature=temperature,
+        )
+        cached = lc.llm_cache.get(key)
+        if cached is not None:
+            yield cached["text"]
+            return cached
+
+    text = ""
+    usage = {"input_tokens": 0, "output_tokens": 0}
+    for rounds in range(1, max_rounds + 1):
+        ## The API rejects a prefill ending in whitespace, so stitch at the trimmed point.
+        text = text.rstrip()
+        stream = stream_instructor_query(
+            system_message,
+            user_message,
+            llm_model,
+            temperature,
+            client_settings,
+            prefill=text or None,
+        )
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            text += delta
+            yield delta
+        for name in usage:
+            usage[name] += result["usage"].get(name, 0)
+        if result["stop_reason"] not in truncated_stop_reasons:
+            break
+    result = {"text": text, "stop_reason": result["stop_reason"], "usage": usage, "rounds": rounds}
+    if key:
+        lc.llm_cache.put(key, result)
+    return result
+
+
+def run_continued_query(*args, **kwargs) -> dict:
+    """Non-streaming form of `stream_continued_query`."""
+    stream = stream_continued_query(*args, **kwargs)
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+
+class StreamReset(str):
+    """A hedged-stream item that replaces (rather than extends) the text streamed so far."""
+
+
+def abort_response(response):
+    """Close an open HTTP response, shutting its socket down first so a thread blocked reading it wakes up."""
+    ## A finished response has handed its connection back to the pool, so leave its socket alone.
+    if response.is_closed:
+        return
+    network_stream = response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class StreamAborter:
+    """Abort callbacks for the HTTP streams a hedged request opens, callable from another thread."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def register(self, callback):
+        """Add a stream's abort callback, running it at once if the request was already aborted."""
+        with self.lock:
+            self.callbacks.append(callback)
+            aborted = self.aborted
+        if aborted:
+            callback()
+
+    def abort(self):
+        """Abort every stream opened so far, and any opened later."""
+        with self.lock:
+            self.aborted = True
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in aborting a stream: {e}")
+
+
+def register_stream_abort(callback):
+    """Let a hedged race abort the stream being opened on this thread (a no-op outside one)."""
+    aborter = getattr(_stream_aborters, "current", None)
+    if aborter is not None:
+        aborter.register(callback)
+
+
+def stream_hedged_query(
+    system_message: str,
+    user_message: str,
+    llm_model: str,
+    hedge_model: str,
+    hedge_delay: float = 5.0,
+    temperature: float = 0.5,
+    client_settings: Optional[dict] = None,
+    max_rounds: int = 3,
+):
+    """Stream a query, sending it to `hedge_model` too if `llm_model` has no first token after `hedge_delay`.
+
+    Deltas are yielded from whichever request produced a token first; the first request
+    to complete wins and the other is cancelled. If the text shown so far came from the
+    other request (the leader failed, or lost the race), a `StreamReset` holding the full
+    text of the request now being followed is yielded instead of a delta. The return value
+    is the winner's `stream_continued_query` result plus the `model` that produced it and
+    whether it was `hedged`.
+    """
+    events = queue.Queue()
+    cancel = threading.Event()
+    models = {"primary": llm_model, "secondary": hedge_model}
+    aborters = {name: StreamAborter() for name in models}
+
+    def race(name: str):
+        _stream_aborters.current = aborters[name]
+        stream = stream_continued_query(
+            system_message, user_message, models[name], temperature, client_settings, max_rounds
+        )
+        try:
+            while not cancel.is_set():
+                try:
+                    delta = next(stream)
+                except StopIteration as stop:
+                    events.put((name, "done", stop.value))
+                    return
+                events.put((name, "delta", delta))
+        except Exception as e:
+            events.put((name, "error", e))
+        finally:
+            stream.close()
+
+    def launch(name: str):
+        started.add(name)
+        threading.Thread(target=race, args=(name,), name=f"hedge-{name}", daemon=True).start()
+
+    start = time.perf_counter()
+    started, finished, failed = set(), set(), set()
+    texts = {name: "" for name in models}
+    leader, shown = None, None
+    launch("primary")
+    try:
+        while True:
+            waiting_on_hedge = "secondary" not in started and leader is None
+            timeout = max(0.0, start + hedge_delay - time.perf_counter()) if waiting_on_hedge else None
+            try:
+                name, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                m.inc("llm_hedge_fired_total", model=llm_model, reason="slow_first_token")
+                launch("secondary")
+                continue
+
+            if kind == "delta":
+                texts[name] += value
+                if leader is None:
+                    leader = name
+                if name == leader:
+                    if shown in (None, name):
+                        yield value
+                    else:
+                        yield StreamReset(texts[name])
+                    shown = name
+            elif kind == "done":
+                finished.add(name)
+                if shown not in (None, name):
+                    yield StreamReset(value["text"])
+                hedged = "secondary" in started
+                m.inc("llm_hedge_wins_total", winner=name, hedged=str(hedged))
+                m.observe("llm_hedged_duration_seconds", time.perf_counter() - start, hedged=str(hedged))
+                return {**value, "model": models[name], "hedged": hedged}
+            else:
+                failed.add(name)
+                if leader == name:
+                    leader = None
+                if "secondary" not in started:
+                    m.inc("llm_hedge_fired_total", model=llm_model, reason="error")
+                    launch("secondary")
+                elif failed == started:
+                    raise value
+    finally:
+        ## Also runs when the consumer abandons the stream. Aborting closes the losing request's
+        ## HTTP response now, instead of when (if ever) it delivers its next delta.
+        cancel.set()
+        for name in started - finished - failed:
+            aborters[name].abort()
+
+
+class AnthropicBatchTransport:
+    """HTTP transport for the Anthropic Message Batches API.
+
+    Any object with the same `submit`, `status` and `results` methods can be passed to
+    `run_instructor_batch` instead, e.g. to point at a local fake batch server.
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, http_client=None):
+        self.base_url = (base_url or os.environ.get("ANTHROPIC_BASE_URL") or "https://api.anthropic.com").rstrip("/")
+        self.headers = {
+            "x-api-key": api_key or os.environ.get("ANTHROPIC_API_KEY", ""),
+            "anthropic-version": "2023-06-01",
+            "anthropic-beta": "message-batches-2024-09-24",
+        }
+        if http_client is None:
+            import httpx
+
+            http_client = httpx.Client(limits=httpx.Limits(**http_limits), timeout=60)
+        self.http_client = http_client
+
+    def submit(self, requests: list) -> str:
+        """Submit [{custom_id, params}] requests and return the batch id."""
+        response = self.http_client.post(
+            f"{self.base_url}/v1/messages/batches", headers=self.headers, json={"requests": requests}
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def status(self, batch_id: str) -> dict:
+        """Get the batch object (`processing_status` is "ended" once results are ready)."""
+        response = self.http_client.get(f"{self.base_url}/v1/messages/batches/{batch_id}", headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def results(self, batch: dict):
+        """Yield the result entries of an ended batch."""
+        response = self.http_client.get(batch["results_url"], headers=self.headers)
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def run_instructor_batch(
+    system_message: str,
+    user_messages: dict,
+    llm_model: str = "claude-3-haiku-20240307",
+    temperature: float = 0.5,
+    transport=None,
+    poll_interval: float = 30,
+    max_poll_interval: float = 600,
+    timeout: float = 24 * 3600,
+) -> dict:
+    """Run many free-text queries through a provider batch endpoint.
+
+    `user_messages` maps a key (e.g. arxiv_code) to its user prompt; the result maps each
+    key to {"text", "stop_reason", "usage"}, or {"error"} if its request failed.
+    """
+    transport = transport or AnthropicBatchTransport()
+    ## Batch custom ids only allow [a-zA-Z0-9_-], so send positional ids and map them back.
+    keys = list(user_messages)
+    requests = [
+        {
+            "custom_id": f"req-{i}",
+            "params": {
+                "model": llm_model,
+                "max_tokens": 4096,
+                "temperature": temperature,
+                "system": system_message,
+                "messages": [{"role": "user", "content": user_messages[key]}],
+            },
+        }
+        for i, key in enumerate(keys)
+    ]
+    batch_id = transport.submit(requests)
+
+    deadline = time.time() + timeout
+    interval = poll_interval
+    while True:
+        batch = transport.status(batch_id)
+        if batch["processing_status"] == "ended":
+            break
+        if time.time() > deadline:
+            raise TimeoutError(f"Batch {batch_id} did not finish in {timeout}s.")
+        time.sleep(interval)
+        interval = min(max_poll_interval, interval * 2)
+
+    results = {}
+    for entry in transport.results(batch):
+        key = keys[int(entry["custom_id"].split("-", 1)[1])]
+        result = entry["result"]
+        if result["type"] != "succeeded":
+            results[key] = {"error": result.get("error", result["type"])}
+            continue
+        message = result["message"]
+        usage = {
+            "input_tokens": message["usage"]["input_tokens"],
+            "output_tokens": message["usage"]["output_tokens"],
+        }
+        m.inc("llm_batch_results_total", model=llm_model)
+        m.inc("llm_input_tokens_total", usage["input_tokens"], model=llm_model)
+        m.inc("llm_output_tokens_total", usage["output_tokens"], model=llm_model)
+        results[key] = {
+            "text": "".join(block.get("text", "") for block in message["content"]),
+            "stop_reason": message["stop_reason"],
+            "usage": usage,
+        }
+    return results
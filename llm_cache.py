@@ -0,0 +1,104 @@
+"""Opt-in, content-addressed disk cache for LLM responses.
+
+Enabled by setting LLM_CACHE_DIR. LLM_CACHE_MODE is "readwrite" (default) or
+"replay", which raises LLMCacheMiss instead of calling the API, so recorded
+responses can serve as offline test fixtures.
+"""
+from typing import Optional
+import threading
+import hashlib
+import json
+import time
+import os
+
+import metrics as m
+
+
+class LLMCacheMiss(KeyError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+class LLMCache:
+    """Size-bounded LRU of JSON responses on disk, keyed by a hash of the full request."""
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float, mode: str = "readwrite"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mode = mode
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(**request) -> str:
+        """Hash a request description (prompts, model, temperature, response model, ...)."""
+        payload = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str, response_model=None):
+        """Get a cached response (validated into `response_model` if given), or None."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            entry = None
+        if entry and self.ttl and time.time() - entry["created"] > self.ttl:
+            entry = None
+        m.inc("cache_requests_total", cache="llm", result="hit" if entry else "miss")
+        if entry is None:
+            if self.mode == "replay":
+                raise LLMCacheMiss(key)
+            return None
+        ## Touch for LRU ordering.
+        os.utime(path)
+        if response_model is not None:
+            return response_model.model_validate(entry["value"])
+        return entry["value"]
+
+    def put(self, key: str, value):
+        """Store a response (text, dict or Pydantic model) and evict the oldest entries past the size bound."""
+        if hasattr(value, "model_dump"):
+            value = value.model_dump(mode="json")
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time.time(), "value": value}, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        with self.lock:
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".json"):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Build the cache from the environment, or None if it is disabled."""
+    directory = os.environ.get("LLM_CACHE_DIR")
+    if not directory:
+        return None
+    return LLMCache(
+        directory,
+        max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        ttl=float(os.environ.get("LLM_CACHE_TTL", 7 * 86400)),
+        mode=os.environ.get("LLM_CACHE_MODE", "readwrite"),
+    )
+
+
+llm_cache = get_llm_cache()
@@ -0,0 +1,176 @@
+"""Lightweight in-process metrics: stage timers, counters and token usage.
+
+Exported as Prometheus text (`render_prometheus`, or `start_metrics_server`) and,
+optionally, written in batches to the `app_metrics` table (`start_metrics_writer`).
+"""
+from contextlib import contextmanager
+from collections import deque
+import threading
+import datetime
+import atexit
+import json
+import time
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+histogram_buckets = {
+    "llm_output_tokens_per_second": (5, 10, 20, 40, 60, 80, 120, 160, 240, 320),
+}
+
+counters = {}
+histograms = {}
+events = deque(maxlen=50_000)
+_lock = threading.Lock()
+_server = None
+_writer = None
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increment a counter."""
+    with _lock:
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+        if _writer:
+            events.append((datetime.datetime.now(), name, labels, value))
+
+
+def observe(name: str, value: float, **labels):
+    """Record a value in a histogram."""
+    buckets = histogram_buckets.get(name, default_buckets)
+    with _lock:
+        key = _key(name, labels)
+        hist = histograms.setdefault(key, {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+        if _writer:
+            events.append((datetime.datetime.now(), name, labels, value))
+
+
+@contextmanager
+def timer(stage: str, timings: dict = None):
+    """Time a block (or, as a decorator, every call) under `stage`, counting errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe("stage_duration_seconds", seconds, stage=stage)
+        if timings is not None:
+            timings[stage] = seconds
+
+
+def record_llm_call(llm_model: str, usage: dict, duration: float, ttft: float = None):
+    """Record token usage, time to first token and throughput for an LLM call."""
+    inc("llm_requests_total", model=llm_model)
+    inc("llm_input_tokens_total", usage.get("input_tokens", 0), model=llm_model)
+    inc("llm_output_tokens_total", usage.get("output_tokens", 0), model=llm_model)
+    observe("llm_duration_seconds", duration, model=llm_model)
+    if ttft is not None:
+        observe("llm_ttft_seconds", ttft, model=llm_model)
+        if usage.get("output_tokens") and duration > ttft:
+            observe("llm_output_tokens_per_second", usage["output_tokens"] / (duration - ttft), model=llm_model)
+
+
+def _format_labels(labels: tuple, extra: dict = None) -> str:
+    items = [*labels, *(extra or {}).items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            buckets = histogram_buckets.get(name, default_buckets)
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, count in zip(buckets, hist["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int):
+    """Serve /metrics for Prometheus scraping (once per process)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            payload = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("", port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+
+
+def flush_metrics():
+    """Write buffered metric events to the `app_metrics` table in one batch."""
+    from sqlalchemy import text
+    import utils as u
+
+    batch = []
+    while events:
+        tstp, name, labels, value = events.popleft()
+        batch.append({"tstp": tstp, "name": name, "labels": json.dumps(labels), "value": value})
+    if not batch:
+        return
+    try:
+        with u.get_engine().begin() as conn:
+            query = text(
+                """
+                INSERT INTO app_metrics (tstp, name, labels, value)
+                VALUES (:tstp, :name, CAST(:labels AS jsonb), :value)
+                """
+            )
+            conn.execute(query, batch)
+    except Exception as e:
+        print(f"Error in writing metrics: {e}")
+
+
+def start_metrics_writer(interval: float):
+    """Buffer metric events and write them to the DB every `interval` seconds (once per process)."""
+    global _writer
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush_metrics()
+
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=run, name="metrics-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush_metrics)
@@ -0,0 +1,224 @@
+"""Schema migrations for the dashboard tables.
+
+Usage: python migrate.py <migration>
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+import utils as u
+
+
+def migrate_quota():
+    """Create the daily generation counter."""
+    with u.get_engine().begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS dashboard_quota (
+                    day DATE PRIMARY KEY,
+                    generations INTEGER NOT NULL DEFAULT 0
+                );
+                """
+            )
+        )
+
+
+def migrate_metrics():
+    """Create the table that batched metric events are written to."""
+    with u.get_engine().begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS app_metrics (
+                    tstp TIMESTAMP NOT NULL,
+                    name TEXT NOT NULL,
+                    labels JSONB,
+                    value DOUBLE PRECISION NOT NULL
+                );
+                """
+            )
+        )
+        conn.execute(
+            text("CREATE INDEX IF NOT EXISTS app_metrics_name_tstp_idx ON app_metrics (name, tstp);")
+        )
+
+
+def add_compression_columns():
+    """Add the codec and compressed bytea columns to arxiv_dashboards."""
+    with u.get_engine().begin() as conn:
+        conn.execute(text("ALTER TABLE arxiv_dashboards ADD COLUMN IF NOT EXISTS codec TEXT;"))
+        for col in u.dashboard_text_columns:
+            conn.execute(text(f"ALTER TABLE arxiv_dashboards ADD COLUMN IF NOT EXISTS {col}_z BYTEA;"))
+
+
+def measure_dashboard_storage(conn) -> dict:
+    """Bytes stored for dashboard text, and the time to read every script over the wire."""
+    plain = " + ".join(f"COALESCE(octet_length({col}), 0)" for col in u.dashboard_text_columns)
+    compressed = " + ".join(f"COALESCE(octet_length({col}_z), 0)" for col in u.dashboard_text_columns)
+    sizes = conn.execute(text(f"SELECT SUM({plain}), SUM({compressed}) FROM arxiv_dashboards;")).fetchone()
+    start = time.time()
+    conn.execute(text("SELECT script_content, script_content_z FROM arxiv_dashboards;")).fetchall()
+    return {
+        "plain_bytes": int(sizes[0] or 0),
+        "compressed_bytes": int(sizes[1] or 0),
+        "read_all_scripts_s": round(time.time() - start, 3),
+    }
+
+
+def migrate_compress(codec: str = "gzip", batch_size: int = 200):
+    """Compress plain-text dashboard rows in batches, reporting size and read latency before and after."""
+    add_compression_columns()
+    with u.get_engine().connect() as conn:
+        before = measure_dashboard_storage(conn)
+    print(f"Before: {before}")
+
+    converted = 0
+    while True:
+        with u.get_engine().begin() as conn:
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT ctid, script_content, summary, scratchpad
+                    FROM arxiv_dashboards
+                    WHERE codec IS NULL
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED;
+                    """
+                ),
+                {"batch_size": batch_size},
+            ).fetchall()
+            if not rows:
+                break
+            updates = [
+                {
+                    "ctid": row.ctid,
+                    "codec": codec,
+                    **{f"{col}_z": u.compress_text(getattr(row, col), codec) for col in u.dashboard_text_columns},
+                }
+                for row in rows
+            ]
+            conn.execute(
+                text(
+                    """
+                    UPDATE arxiv_dashboards
+                    SET codec = :codec,
+                        script_content_z = :script_content_z, summary_z = :summary_z, scratchpad_z = :scratchpad_z,
+                        script_content = NULL, summary = NULL, scratchpad = NULL
+                    WHERE ctid = CAST(:ctid AS tid);
+                    """
+                ),
+                updates,
+            )
+        converted += len(rows)
+        print(f"Compressed {converted} rows...")
+
+    with u.get_engine().connect() as conn:
+        after = measure_dashboard_storage(conn)
+    print(f"After: {after}")
+
+
+def migrate_versions():
+    """Version dashboard rows, dedupe them, and add the per-paper current-version pointer table."""
+    add_compression_columns()
+    content_columns = [*u.dashboard_text_columns, *(f"{col}_z" for col in u.dashboard_text_columns)]
+    with u.get_engine().begin() as conn:
+        conn.execute(text("LOCK TABLE arxiv_dashboards IN SHARE ROW EXCLUSIVE MODE;"))
+        conn.execute(text("ALTER TABLE arxiv_dashboards ADD COLUMN IF NOT EXISTS version INTEGER;"))
+        ## Identical regenerations (e.g. from races) are dropped, keeping the earliest copy.
+        same_content = " AND ".join(f"newer.{col} IS NOT DISTINCT FROM older.{col}" for col in content_columns)
+        deleted = conn.execute(
+            text(
+                f"""
+                DELETE FROM arxiv_dashboards newer
+                USING arxiv_dashboards older
+                WHERE newer.arxiv_code = older.arxiv_code
+                AND newer.version IS NULL AND older.version IS NULL
+                AND (newer.tstp, newer.ctid) > (older.tstp, older.ctid)
+                AND {same_content};
+                """
+            )
+        ).rowcount
+        print(f"Deleted {deleted} duplicate dashboard rows.")
+        conn.execute(
+            text(
+                """
+                UPDATE arxiv_dashboards d
+                SET version = v.version
+                FROM (
+                    SELECT ctid,
+                           COALESCE((SELECT MAX(version) FROM arxiv_dashboards x WHERE x.arxiv_code = a.arxiv_code), 0)
+                           + ROW_NUMBER() OVER (PARTITION BY arxiv_code ORDER BY tstp, ctid) AS version
+                    FROM arxiv_dashboards a
+                    WHERE version IS NULL
+                ) v
+                WHERE d.ctid = v.ctid;
+                """
+            )
+        )
+        conn.execute(text("ALTER TABLE arxiv_dashboards ALTER COLUMN version SET NOT NULL;"))
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS arxiv_dashboards_code_version_idx "
+                "ON arxiv_dashboards (arxiv_code, version);"
+            )
+        )
+        ## Covers the per-day generation count (tstp range, distinct arxiv_code) as an index-only scan.
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS arxiv_dashboards_tstp_code_idx "
+                "ON arxiv_dashboards (tstp) INCLUDE (arxiv_code);"
+            )
+        )
+        ## Superseded by the covering index above (older `quota` migrations created it).
+        conn.execute(text("DROP INDEX IF EXISTS arxiv_dashboards_tstp_idx;"))
+        conn.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS arxiv_dashboard_current (
+                    arxiv_code TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    tstp TIMESTAMP NOT NULL
+                );
+                """
+            )
+        )
+        conn.execute(
+            text(
+                """
+                INSERT INTO arxiv_dashboard_current (arxiv_code, version, tstp)
+                SELECT DISTINCT ON (arxiv_code) arxiv_code, version, COALESCE(tstp, NOW())
+                FROM arxiv_dashboards
+                ORDER BY arxiv_code, version DESC
+                ON CONFLICT (arxiv_code) DO UPDATE
+                SET version = EXCLUDED.version, tstp = EXCLUDED.tstp
+                WHERE arxiv_dashboard_current.version < EXCLUDED.version;
+                """
+            )
+        )
+
+
+migrations = {
+    "quota": migrate_quota,
+    "metrics": migrate_metrics,
+    "compress": migrate_compress,
+    "versions": migrate_versions,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a schema migration.")
+    parser.add_argument("migration", choices=list(migrations))
+    parser.add_argument("--codec", default="gzip", choices=["gzip", "zstd"], help="For `compress`.")
+    parser.add_argument("--batch-size", type=int, default=200, help="For `compress`.")
+    args = parser.parse_args()
+    if args.migration == "compress":
+        migrate_compress(args.codec, args.batch_size)
+    else:
+        migrations[args.migration]()
+    print(f"Migration '{args.migration}' done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Background worker that pre-generates dashboards for popular and new papers.
+
+Usage: python pregenerate.py [--days 7] [--limit 100] [--workers 2] [--per-minute 4]
+       python pregenerate.py --batch [--limit 1000]   # backfill through the batch API
+
+With --build-assets, the vendored Tailwind CSS is rebuilt afterwards so the new
+dashboards' classes are precompiled (see build_assets.py).
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import threading
+import json
+import time
+import os
+
+import utils as u
+import prompts as p
+import generate as g
+import build_assets as ba
+from instruct import run_instructor_batch, truncated_stop_reasons
+
+
+class RateLimiter:
+    """Space out calls so at most `per_minute` start in any minute."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+def load_progress(path: str) -> dict:
+    """Load the {arxiv_code: status} progress log written by previous runs."""
+    progress = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                progress[entry["arxiv_code"]] = entry["status"]
+    return progress
+
+
+def pregenerate(arxiv_code: str, paper: dict, limiter: RateLimiter) -> str:
+    """Generate a single dashboard, returning its final status."""
+    if paper is None or not paper["notes"]:
+        return "skipped"
+    if paper["script_content"]:
+        return "done"
+    limiter.wait()
+    g.generate_dashboard(arxiv_code, paper["title"], paper["notes"])
+    return "done"
+
+
+def pregenerate_batch(candidates: list, papers: dict, poll_interval: float) -> dict:
+    """Generate dashboards through the batch API and save them in bulk; returns {arxiv_code: status}."""
+    statuses = {}
+    prompts = {}
+    for code in candidates:
+        paper = papers.get(code)
+        if paper is None or not paper["notes"]:
+            statuses[code] = "skipped"
+        elif paper["script_content"]:
+            statuses[code] = "done"
+        else:
+            prompts[code] = p.artifacts_user_prompt.format(title=paper["title"], content=paper["notes"])
+    if not prompts:
+        return statuses
+
+    results = run_instructor_batch(
+        p.artifacts_system_prompt,
+        prompts,
+        llm_model=g.dashboard_llm_model,
+        temperature=g.dashboard_temperature,
+        poll_interval=poll_interval,
+    )
+    dashboards = []
+    for code, result in results.items():
+        ## Truncated outputs are left for the synchronous path, which can continue them.
+        if "error" in result or result["stop_reason"] in truncated_stop_reasons:
+            statuses[code] = "failed"
+            continue
+        try:
+            summary, script = g.parse_dashboard_response(result["text"])
+        except IndexError:
+            statuses[code] = "failed"
+            continue
+        dashboards.append({"arxiv_code": code, "summary": summary, "scratchpad": "", "script": script})
+        statuses[code] = "done"
+    u.save_arxiv_dashboard_scripts(dashboards)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate missing arxiv dashboards.")
+    parser.add_argument("--days", type=int, default=7, help="Request window used for ranking.")
+    parser.add_argument("--limit", type=int, default=100, help="Max papers per run.")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent generations.")
+    parser.add_argument("--per-minute", type=float, default=4, help="Max LLM calls started per minute.")
+    parser.add_argument("--progress", default="pregenerate_progress.jsonl", help="Resumable progress log.")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry papers that failed before.")
+    parser.add_argument("--batch", action="store_true", help="Use the provider batch API (slower, cheaper).")
+    parser.add_argument("--poll-interval", type=float, default=30, help="Initial batch poll interval (s).")
+    parser.add_argument("--build-assets", action="store_true", help="Rebuild the precompiled Tailwind CSS afterwards.")
+    args = parser.parse_args()
+
+    progress = load_progress(args.progress)
+    skip = {"done", "skipped"} | (set() if args.retry_failed else {"failed"})
+    candidates = [
+        code for code, _ in u.get_pregeneration_candidates(args.days, args.limit)
+        if progress.get(code) not in skip
+    ]
+    print(f"Pre-generating {len(candidates)} dashboards with {args.workers} workers.")
+    budget = g.get_notes_token_budget()
+    u.refresh_note_index(full=True)
+    note_levels = {code: u.select_note_level(code, budget) for code in candidates}
+    papers = u.load_paper_contexts(candidates, budget, note_levels)
+
+    if args.batch:
+        statuses = pregenerate_batch(candidates, papers, args.poll_interval)
+        with open(args.progress, "a") as log:
+            for code, status in statuses.items():
+                log.write(json.dumps({"arxiv_code": code, "status": status}) + "\n")
+                print(f"{code}: {status}")
+        if args.build_assets:
+            ba.build()
+        return
+
+    limiter = RateLimiter(args.per_minute)
+    with open(args.progress, "a") as log, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(pregenerate, code, papers.get(code), limiter): code
+            for code in candidates
+        }
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"Error generating {code}: {e}")
+                status = "failed"
+            log.write(json.dumps({"arxiv_code": code, "status": status}) + "\n")
+            log.flush()
+            print(f"{code}: {status}")
+    if args.build_assets:
+        ba.build()
+
+
+if __name__ == "__main__":
+    main()
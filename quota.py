@@ -0,0 +1,87 @@
+"""Generation quota: a DB-backed daily counter plus a process-local token bucket."""
+import threading
+import datetime
+import time
+import os
+
+import utils as u
+
+
+class QuotaExceededError(Exception):
+    """Raised when a generation is refused by the daily or per-minute limit (`limit`)."""
+
+    def __init__(self, message: str, limit: str):
+        super().__init__(message)
+        self.limit = limit
+
+
+class QuotaLimiter:
+    """Answer "may I generate?" from memory, syncing the daily count from the DB periodically."""
+
+    def __init__(self, daily_limit: int, per_minute: float, sync_interval: float = 30):
+        self.daily_limit = daily_limit
+        self.per_minute = per_minute
+        self.sync_interval = sync_interval
+        self.tokens = float(per_minute)
+        self.refilled_at = time.monotonic()
+        self.day = None
+        self.daily_count = 0
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.refilled_at
+        self.tokens = min(self.per_minute, self.tokens + elapsed * self.per_minute / 60)
+        self.refilled_at = now
+
+    def sync(self):
+        """Refresh the local copy of today's count from the DB counter row."""
+        day = datetime.date.today().isoformat()
+        count = u.get_daily_generation_count(day)
+        with self.lock:
+            self.day, self.daily_count = day, count
+            self.synced_at = time.monotonic()
+
+    def exhausted_limit(self):
+        """Check both limits without consuming anything; returns "daily", "per_minute" or None."""
+        now = time.monotonic()
+        if now - self.synced_at > self.sync_interval or self.day != datetime.date.today().isoformat():
+            self.sync()
+        with self.lock:
+            self._refill(now)
+            if self.daily_count >= self.daily_limit:
+                return "daily"
+            if self.tokens < 1:
+                return "per_minute"
+            return None
+
+    def may_generate(self) -> bool:
+        """Check both limits without consuming anything."""
+        return self.exhausted_limit() is None
+
+    def acquire(self):
+        """Consume one generation from both limits, raising QuotaExceededError if either is exhausted."""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                raise QuotaExceededError("Too many generations this minute.", "per_minute")
+            self.tokens -= 1
+        count = u.increment_daily_generation_count(datetime.date.today().isoformat(), self.daily_limit)
+        with self.lock:
+            if count is None:
+                self.daily_count = self.daily_limit
+                raise QuotaExceededError("Daily generation limit reached.", "daily")
+            self.daily_count = count
+
+
+## What the user is told when each limit is exhausted.
+limit_messages = {
+    "daily": "Too many requests today. Please try again tomorrow!",
+    "per_minute": "Too many requests right now. Please try again in a minute!",
+}
+
+limiter = QuotaLimiter(
+    daily_limit=int(os.environ.get("QUOTA_DAILY_LIMIT", 50)),
+    per_minute=float(os.environ.get("QUOTA_PER_MINUTE", 5)),
+    sync_interval=float(os.environ.get("QUOTA_SYNC_INTERVAL", 30)),
+)
@@ -0,0 +1,323 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import gzip
+import os
+
+import metrics as m
+
+## Front-end runtime: "cdn" loads from unpkg/tailwindcss.com, "local" from the vendored
+## copies (built with `python build_assets.py`), "inline" embeds them in each page.
+## "local" needs DASHBOARD_ASSETS_URL pointing at `python build_assets.py serve` (or a
+## CDN in front of it): Streamlit's static serving sends .js/.css as text/plain with
+## nosniff, which browsers refuse to run, and no long-lived cache headers.
+##
+## The precompiled Tailwind CSS has the classes of scripts stored at build time plus a
+## safelist of the utilities generated dashboards use, so new scripts render without the
+## Tailwind runtime. DASHBOARD_TAILWIND_JIT=1 also loads that runtime from its CDN, as a
+## stopgap until the next build (e.g. `python pregenerate.py --build-assets`).
+asset_mode = os.environ.get("DASHBOARD_ASSETS", "cdn")
+assets_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "vendor")
+assets_url = os.environ.get("DASHBOARD_ASSETS_URL")
+tailwind_jit = os.environ.get("DASHBOARD_TAILWIND_JIT", "0") == "1"
+tailwind_jit_url = "https://cdn.tailwindcss.com"
+
+cdn_assets = [
+    "https://unpkg.com/react@17.0.2/umd/react.production.min.js",
+    "https://unpkg.com/react-dom@17.0.2/umd/react-dom.production.min.js",
+    "https://unpkg.com/prop-types/prop-types.min.js",
+    "https://unpkg.com/recharts/umd/Recharts.js",
+    tailwind_jit_url,
+]
+
+## Pinned copies fetched by build_assets.py; Tailwind is precompiled to static CSS instead.
+vendor_assets = {
+    "react.production.min.js": "https://unpkg.com/react@17.0.2/umd/react.production.min.js",
+    "react-dom.production.min.js": "https://unpkg.com/react-dom@17.0.2/umd/react-dom.production.min.js",
+    "prop-types.min.js": "https://unpkg.com/prop-types@15.8.1/prop-types.min.js",
+    "Recharts.js": "https://unpkg.com/recharts@2.12.7/umd/Recharts.js",
+}
+tailwind_css = "tailwind.min.css"
+
+
+def build_assets_head(mode: str) -> str:
+    """Build the <head> tags that load the dashboard's front-end runtime."""
+    if mode == "cdn":
+        return "\n    ".join(f'<script src="{url}"></script>' for url in cdn_assets)
+
+    with open(os.path.join(assets_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    tags = []
+    for name in [*vendor_assets, tailwind_css]:
+        if mode == "inline":
+            with open(os.path.join(assets_dir, name)) as f:
+                body = f.read()
+            if name.endswith(".css"):
+                tags.append(f"<style>{body}</style>")
+            else:
+                tags.append("<script>" + body.replace("</script", "<\\/script") + "</script>")
+        else:
+            ## Content-hashed URLs, so they can be cached as immutable.
+            url = f"{assets_url}/{name}?v={manifest[name]}"
+            if name.endswith(".css"):
+                tags.append(f'<link rel="stylesheet" href="{url}">')
+            else:
+                tags.append(f'<script src="{url}"></script>')
+    if tailwind_jit:
+        tags.append(f'<script src="{tailwind_jit_url}"></script>')
+    return "\n    ".join(tags)
+
+
+if asset_mode == "local" and not assets_url:
+    print("DASHBOARD_ASSETS=local needs DASHBOARD_ASSETS_URL (see `python build_assets.py serve`), using CDN.")
+    asset_mode = "cdn"
+try:
+    assets_head = build_assets_head(asset_mode)
+except FileNotFoundError:
+    print(f"Vendored assets missing in {assets_dir}, falling back to CDN (run `python build_assets.py`).")
+    assets_head = build_assets_head("cdn")
+
+html_template = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    {assets}
+<style>
+    body, html {{
+        margin: 0;
+        padding: 0;
+        font-family: Arial, sans-serif;
+        background-color: #FFF5E6;
+        border-radius: 10px;
+    }}
+    p {{
+        font-size: 0.9em;
+        }}
+    #header {{
+        position: fixed;
+        top: 0;
+        width: 100%;
+        z-index: 100;
+        background-color: #FF8C00;
+        color: white;
+        padding: 20px;
+        text-align: center;
+        font-size: 2em;
+    }}
+    #summary {{
+    position: fixed;
+    top: 0px; /* Adjust this value based on the height of your header */
+    left: 0;
+    right: 0;
+    margin: auto;
+    width: 100%;
+    z-index: 100;
+    background-color: #FFA500;
+    color: white;
+    padding: 10px;
+    border-radius: 10px;
+    text-align: center;
+    box-shadow: 0 2px 2px rgba(0, 0, 0, 0.2);
+    text-shadow: 0 1px 2px rgba(0, 0, 0, 0.25);
+    font-weight: bold;
+    border: 1px solid rgba(255, 255, 255, 0.2);
+    }}
+    #root {{
+        padding: 20px;
+        margin-top: 110px; /* Adjust this value based on the combined height of your summary */
+    }}
+</style>
+</head>
+<body>
+    <div id="summary">
+        {summary}
+    </div>
+    <div id="root"></div>
+    <script>
+        // Card component
+        const Card = ({{ children, className, style }}) => (
+            React.createElement('div', {{ className: `card ${{className}}`, style: {{ ...style, backgroundColor: '#FFF8E1', borderRadius: '8px', boxShadow: '0 4px 8px rgba(0, 0, 0, 0.1)', overflow: 'hidden', transition: 'all 0.3s ease-in-out' }} }}, children)
+        );
+        
+        const CardContent = ({{ children, className }}) => (
+            React.createElement('div', {{ className: `card-content ${{className}}`, style: {{ padding: '16px', color: '#333333' }} }}, children)
+        );
+        
+        // Tabs components
+        const Tabs = ({{ defaultValue, children, className }}) => {{
+            const [activeTab, setActiveTab] = React.useState(defaultValue);
+        
+            const handleClick = (value) => {{
+                setActiveTab(value);
+            }};
+        
+            return React.createElement('div', {{ className }},
+                React.createElement(TabsList, {{ activeTab, handleClick, className: "tabs-header" }}, 
+                    React.Children.map(children, child => child.type === TabsTrigger ? React.cloneElement(child, {{ activeTab, handleClick }}) : null)
+                ),
+                React.Children.map(children, child => child.type === TabsContent ? React.cloneElement(child, {{ activeTab }}) : null)
+            );
+        }};
+        
+        const TabsList = ({{ children, activeTab, handleClick, className }}) => (
+            React.createElement('div', {{
+                className: `tabs-list ${{className}}`,
+                style: {{
+                    // position: 'fixed', // Make it fixed at the top
+                    width: '100%',
+                    display: 'flex',
+                    justifyContent: 'space-around',
+                    padding: '8px 0',
+                    background: '#FFF8E1',
+                    borderBottom: '3px solid #FF8C00',
+                    zIndex: '101', // Ensure it's above other content, adjust as necessary
+                }}
+            }},
+            React.Children.map(children, child =>
+                React.cloneElement(child, {{ activeTab, handleClick }})
+            ))
+        );
+        
+        const TabsTrigger = ({{ value, children, activeTab, handleClick, className }}) => (
+            React.createElement('button', {{
+                className: `tabs-trigger ${{className}} ${{activeTab === value ? 'active' : ''}}`,
+                onClick: () => handleClick(value),
+                style: {{ padding: '8px 16px', cursor: 'pointer', borderBottom: activeTab === value ? '2px solid #FF8C00' : 'none', transition: 'all 0.3s ease-in-out' }}
+            }}, children)
+        );
+        
+        const TabsContent = ({{ value, children, activeTab, className }}) => (
+            React.createElement('div', {{
+                className: `tabs-content ${{className}}`,
+                style: {{ display: activeTab === value ? 'block' : 'none', padding: '16px'}}
+            }}, children)
+        );
+        {script}
+
+        // Calculate margin-top
+        const summaryText = document.getElementById('summary').innerText;
+        
+        const charsPerLine = 75;
+        const numberOfLines = Math.ceil(summaryText.length / charsPerLine);
+        
+        const baseMargin = 110; // Base margin for 4 lines
+        const additionalMarginPerTwoLines = 40; // Additional margin for every 2 lines above 4
+        let marginTop = baseMargin;
+        if (numberOfLines > 4) {{
+            marginTop += Math.floor((numberOfLines - 4) / 2) * additionalMarginPerTwoLines;
+        }}        
+        document.getElementById('root').style.marginTop = `${{marginTop}}px`;
+    </script>
+</body>
+</html>"""
+
+template_hash = hashlib.sha256((html_template + assets_head).encode()).hexdigest()[:12]
+
+
+def render_dashboard_html(title: str, summary: str, script: str) -> str:
+    """Render a dashboard's standalone HTML page."""
+    return html_template.format(assets=assets_head, title=title, summary=summary, script=script)
+
+
+def get_content_hash(title: str, summary: str, script: str) -> str:
+    """Hash the dashboard fields that feed the template."""
+    digest = hashlib.sha256()
+    for part in (title, summary, script):
+        digest.update((part or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class ArtifactCache:
+    """Memory-bounded LRU of gzipped rendered HTML, backed by a local directory.
+
+    Entries are tagged with the content hash they were rendered from and, when known,
+    the dashboard version ("<version>:<tstp>" of `arxiv_dashboard_current`), so a
+    version saved by another process is noticed with a primary-key lookup.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, arxiv_code: str) -> str:
+        return os.path.join(self.directory, f"{arxiv_code}-{template_hash}.html.gz")
+
+    def _remember(self, arxiv_code: str, entry: tuple):
+        with self.lock:
+            old = self.entries.pop(arxiv_code, None)
+            if old:
+                self.size -= len(old[2])
+            self.entries[arxiv_code] = entry
+            self.size += len(entry[2])
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, blob) = self.entries.popitem(last=False)
+                self.size -= len(blob)
+
+    def get(self, arxiv_code: str, content_hash: str = None, version: str = None):
+        """Get cached HTML, or None on a miss or if it was rendered from other content or another version."""
+        with self.lock:
+            entry = self.entries.get(arxiv_code)
+            if entry:
+                self.entries.move_to_end(arxiv_code)
+        if entry is None:
+            try:
+                with open(self._path(arxiv_code), "rb") as f:
+                    header, blob = f.read().split(b"\n", 1)
+            except FileNotFoundError:
+                m.inc("cache_requests_total", cache="artifact", result="miss")
+                return None
+            stored_hash, _, stored_version = header.decode().partition(" ")
+            entry = (stored_hash, stored_version or None, blob)
+            self._remember(arxiv_code, entry)
+        if (content_hash and entry[0] != content_hash) or (version and entry[1] != version):
+            entry = None
+        m.inc("cache_requests_total", cache="artifact", result="hit" if entry else "miss")
+        if entry is None:
+            return None
+        return gzip.decompress(entry[2]).decode()
+
+    def put(self, arxiv_code: str, html: str, content_hash: str, version: str = None):
+        """Store rendered HTML in memory and on disk."""
+        entry = (content_hash, version, gzip.compress(html.encode()))
+        self._remember(arxiv_code, entry)
+        header = content_hash if version is None else f"{content_hash} {version}"
+        tmp_path = self._path(arxiv_code) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.encode() + b"\n" + entry[2])
+        os.replace(tmp_path, self._path(arxiv_code))
+
+    def invalidate(self, arxiv_code: str):
+        """Drop a paper's rendered HTML, e.g. after its script row changes."""
+        with self.lock:
+            entry = self.entries.pop(arxiv_code, None)
+            if entry:
+                self.size -= len(entry[2])
+        try:
+            os.remove(self._path(arxiv_code))
+        except FileNotFoundError:
+            pass
+
+
+artifact_cache = ArtifactCache(
+    os.environ.get("ARTIFACT_CACHE_DIR", ".artifact_cache"),
+    int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
+
+@m.timer("render.get_dashboard_html")
+def get_dashboard_html(arxiv_code: str, title: str, summary: str, script: str, version: str = None) -> str:
+    """Get a dashboard's HTML from the artifact cache, rendering and storing it (tagged with `version`) on a miss."""
+    content_hash = get_content_hash(title, summary, script)
+    html = artifact_cache.get(arxiv_code, content_hash, version)
+    if html is None:
+        html = render_dashboard_html(title, summary, script)
+        artifact_cache.put(arxiv_code, html, content_hash, version)
+    return html
@@ -0,0 +1,206 @@
+"""Data access for papers and dashboards with bound parameters, whitelisted columns and typed rows.
+
+Hot lookups run as server-side prepared statements: each pooled connection
+PREPAREs a statement the first time it needs it and EXECUTEs it afterwards, so
+Postgres parses and plans it once per connection instead of once per call. Set
+DB_PREPARED_STATEMENTS=0 behind a transaction-mode pooler (e.g. PgBouncer),
+which does not keep session state; queries then run with plain bound parameters.
+"""
+from typing import NamedTuple, Optional, TypedDict
+import json
+import os
+import re
+
+from sqlalchemy import text
+
+import db
+
+## Matches `:name` bind parameters (but not `::` casts).
+bind_param_pattern = re.compile(r"(?<![:\w]):(\w+)")
+
+
+class NoteRow(NamedTuple):
+    level: int
+    summary: str
+    tokens: Optional[int]
+
+
+class PaperContext(TypedDict):
+    arxiv_code: str
+    title: Optional[str]
+    recursive_summary: Optional[str]
+    notes_level: Optional[int]
+    notes: Optional[str]
+    script_content: Optional[str]
+    dashboard_summary: Optional[str]
+    dashboard_version: Optional[str]
+
+
+## name -> (SQL with :params, {param: Postgres type}), in parameter order.
+statements = {
+    "recursive_summary": (
+        "SELECT summary FROM recursive_summaries WHERE arxiv_code = :arxiv_code",
+        {"arxiv_code": "text"},
+    ),
+    "notes_by_level": (
+        """
+        SELECT level, summary, tokens FROM summary_notes
+        WHERE arxiv_code = :arxiv_code AND level = :level
+        LIMIT 1
+        """,
+        {"arxiv_code": "text", "level": "integer"},
+    ),
+    "notes_by_tokens": (
+        """
+        SELECT level, summary, tokens FROM summary_notes
+        WHERE arxiv_code = :arxiv_code
+        ORDER BY ABS(tokens - :expected_tokens) ASC
+        LIMIT 1
+        """,
+        {"arxiv_code": "text", "expected_tokens": "integer"},
+    ),
+    "notes_top_level": (
+        """
+        SELECT level, summary, tokens FROM summary_notes
+        WHERE arxiv_code = :arxiv_code
+        ORDER BY level DESC
+        LIMIT 1
+        """,
+        {"arxiv_code": "text"},
+    ),
+    **{
+        f"dashboard_{col}": (
+            f"""
+            SELECT d.codec, d.{col}, d.{col}_z
+            FROM arxiv_dashboard_current c
+            JOIN arxiv_dashboards d ON d.arxiv_code = c.arxiv_code AND d.version = c.version
+            WHERE c.arxiv_code = :arxiv_code
+            """,
+            {"arxiv_code": "text"},
+        )
+        for col in db.dashboard_text_columns
+    },
+    "dashboard_version": (
+        """
+        SELECT version::text || ':' || tstp::text AS dashboard_version
+        FROM arxiv_dashboard_current
+        WHERE arxiv_code = :arxiv_code
+        """,
+        {"arxiv_code": "text"},
+    ),
+    "paper_contexts": (
+        """
+        SELECT a.arxiv_code, a.title, r.summary AS recursive_summary,
+               n.level AS notes_level, n.summary AS notes,
+               d.codec, d.script_content, d.summary AS dashboard_summary,
+               d.script_content_z, d.summary_z AS dashboard_summary_z,
+               c.version::text || ':' || c.tstp::text AS dashboard_version
+        FROM arxiv_details a
+        LEFT JOIN recursive_summaries r ON r.arxiv_code = a.arxiv_code
+        LEFT JOIN LATERAL (
+            SELECT s.level, s.summary
+            FROM summary_notes s
+            WHERE s.arxiv_code = a.arxiv_code
+            ORDER BY (s.level::text = (:note_levels ->> s.arxiv_code)) IS TRUE DESC,
+                     ABS(s.tokens - :expected_tokens) ASC
+            LIMIT 1
+        ) n ON TRUE
+        LEFT JOIN arxiv_dashboard_current c ON c.arxiv_code = a.arxiv_code
+        LEFT JOIN arxiv_dashboards d ON d.arxiv_code = c.arxiv_code AND d.version = c.version
+        WHERE a.arxiv_code = ANY(:arxiv_codes)
+        """,
+        {"arxiv_codes": "text[]", "expected_tokens": "integer", "note_levels": "jsonb"},
+    ),
+}
+
+
+class PaperStore:
+    """Repository for paper and dashboard reads, running `statements` prepared or with bound parameters."""
+
+    def __init__(self, get_engine, prepared: bool = True):
+        self.get_engine = get_engine
+        self.prepared = prepared
+
+    def _plain_query(self, name: str):
+        sql, types = statements[name]
+        ## Typed binds, so the unprepared path resolves parameters like the prepared one.
+        return text(bind_param_pattern.sub(lambda p: f"CAST(:{p.group(1)} AS {types[p.group(1)]})", sql))
+
+    def _prepare(self, conn, name: str):
+        """PREPARE a statement on this connection unless it already has it."""
+        prepared = conn.connection.info.setdefault("paper_store_prepared", set())
+        if name in prepared:
+            return
+        sql, types = statements[name]
+        positions = {param: i for i, param in enumerate(types, start=1)}
+        body = bind_param_pattern.sub(lambda p: f"${positions[p.group(1)]}", sql)
+        conn.exec_driver_sql(f"PREPARE paper_store_{name} ({', '.join(types.values())}) AS {body}")
+        prepared.add(name)
+
+    def execute(self, name: str, **params):
+        """Run a named statement and return all its rows."""
+        _, types = statements[name]
+        with self.get_engine().connect() as conn:
+            if self.prepared:
+                self._prepare(conn, name)
+                args = ", ".join(f":{param}" for param in types)
+                query = text(f"EXECUTE paper_store_{name} ({args})")
+            else:
+                query = self._plain_query(name)
+            rows = conn.execute(query, params).fetchall()
+            conn.commit()
+        return rows
+
+    def get_recursive_summary(self, arxiv_code: str) -> Optional[str]:
+        """Get a paper's recursive summary."""
+        rows = self.execute("recursive_summary", arxiv_code=arxiv_code)
+        return rows[0].summary if rows else None
+
+    def get_notes(self, arxiv_code: str, level: int = None, expected_tokens: int = None) -> Optional[NoteRow]:
+        """Get a paper's notes at `level`, else closest to `expected_tokens`, else at the top level."""
+        if level:
+            rows = self.execute("notes_by_level", arxiv_code=arxiv_code, level=int(level))
+        elif expected_tokens:
+            rows = self.execute("notes_by_tokens", arxiv_code=arxiv_code, expected_tokens=int(expected_tokens))
+        else:
+            rows = self.execute("notes_top_level", arxiv_code=arxiv_code)
+        return NoteRow(*rows[0]) if rows else None
+
+    def get_dashboard_field(self, arxiv_code: str, column: str) -> Optional[str]:
+        """Get one decoded text column of a paper's current dashboard."""
+        if column not in db.dashboard_text_columns:
+            raise ValueError(f"Unknown dashboard column {column!r}; expected one of {db.dashboard_text_columns}.")
+        rows = self.execute(f"dashboard_{column}", arxiv_code=arxiv_code)
+        if not rows:
+            return None
+        codec, plain, compressed = rows[0]
+        return db.decode_dashboard_fields(codec, {column: plain}, {column: compressed})[column]
+
+    def get_dashboard_version(self, arxiv_code: str) -> Optional[str]:
+        """Get the "<version>:<tstp>" tag of a paper's current dashboard, or None if it has none."""
+        rows = self.execute("dashboard_version", arxiv_code=arxiv_code)
+        return rows[0].dashboard_version if rows else None
+
+    def load_paper_contexts(self, arxiv_codes: list, expected_tokens: int, note_levels: dict = None) -> dict:
+        """Load {arxiv_code: PaperContext} for many papers in one round trip."""
+        rows = self.execute(
+            "paper_contexts",
+            arxiv_codes=list(arxiv_codes),
+            expected_tokens=int(expected_tokens),
+            note_levels=json.dumps({k: str(v) for k, v in (note_levels or {}).items()}),
+        )
+        contexts = {}
+        for row in rows:
+            context = dict(row._mapping)
+            codec = context.pop("codec")
+            compressed = {
+                "script_content": context.pop("script_content_z"),
+                "dashboard_summary": context.pop("dashboard_summary_z"),
+            }
+            plain = {key: context[key] for key in compressed}
+            context.update(db.decode_dashboard_fields(codec, plain, compressed))
+            contexts[row.arxiv_code] = PaperContext(**context)
+        return contexts
+
+
+paper_store = PaperStore(db.get_engine, prepared=os.environ.get("DB_PREPARED_STATEMENTS", "1") != "0")
@@ -0,0 +1,267 @@
+"""Offline tests of the client registry and the continued, hedged and batch LLM paths."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import json
+
+import pytest
+
+import instruct
+import llm_cache as lc
+
+
+def make_stub(rounds: list, calls: list):
+    """Stub `stream_instructor_query` answering each round with (deltas, stop_reason)."""
+
+    def stream_instructor_query(system_message, user_message, llm_model, temperature, client_settings, prefill=None):
+        calls.append(prefill)
+        deltas, stop_reason = rounds[len(calls) - 1]
+        yield from deltas
+        return {"stop_reason": stop_reason, "usage": {"input_tokens": 10, "output_tokens": len(deltas)}}
+
+    return stream_instructor_query
+
+
+def run(monkeypatch, rounds: list, calls: list, user_message: str = "user"):
+    monkeypatch.setattr(instruct, "stream_instructor_query", make_stub(rounds, calls))
+    deltas = []
+    stream = instruct.stream_continued_query("system", user_message, "stub-model", max_rounds=3)
+    while True:
+        try:
+            deltas.append(next(stream))
+        except StopIteration as stop:
+            return deltas, stop.value
+
+
+def test_continued_stream_without_cache(monkeypatch):
+    monkeypatch.setattr(lc, "llm_cache", None)
+    calls = []
+    deltas, result = run(monkeypatch, [(["Hello ", "wor"], "max_tokens"), (["ld"], "end_turn")], calls)
+    assert "".join(deltas) == "Hello world"
+    assert calls == [None, "Hello wor"]
+    assert result == {
+        "text": "Hello world",
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 20, "output_tokens": 3},
+        "rounds": 2,
+    }
+
+
+def test_continued_stream_with_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(lc, "llm_cache", lc.LLMCache(str(tmp_path), max_bytes=1 << 20, ttl=0))
+    calls = []
+    _, first = run(monkeypatch, [(["cached"], "end_turn")], calls)
+    deltas, second = run(monkeypatch, [], calls)
+    assert len(calls) == 1
+    assert deltas == ["cached"]
+    assert second == first
+    ## Different prompts must not share an entry.
+    _, other = run(monkeypatch, [(["other"], "end_turn")], [], user_message="another user")
+    assert other["text"] == "other"
+
+
+def test_continued_stream_replay(monkeypatch, tmp_path):
+    monkeypatch.setattr(lc, "llm_cache", lc.LLMCache(str(tmp_path), max_bytes=1 << 20, ttl=0))
+    run(monkeypatch, [(["recorded"], "end_turn")], [])
+    lc.llm_cache.mode = "replay"
+    deltas, result = run(monkeypatch, [], [])
+    assert result["text"] == "recorded"
+    with pytest.raises(lc.LLMCacheMiss):
+        run(monkeypatch, [], [], user_message="never recorded")
+
+
+def test_hedged_stream_resets_text_when_leader_fails(monkeypatch):
+    def stream_continued_query(system_message, user_message, llm_model, *args, **kwargs):
+        if llm_model == "primary-model":
+            yield "garbled "
+            raise RuntimeError("connection reset")
+        yield "Hello "
+        yield "world"
+        return {"text": "Hello world", "stop_reason": "end_turn", "usage": {}, "rounds": 1}
+
+    monkeypatch.setattr(instruct, "stream_continued_query", stream_continued_query)
+    stream = instruct.stream_hedged_query("system", "user", "primary-model", "hedge-model", hedge_delay=60)
+    shown = ""
+    while True:
+        try:
+            delta = next(stream)
+        except StopIteration as stop:
+            result = stop.value
+            break
+        shown = str(delta) if isinstance(delta, instruct.StreamReset) else shown + delta
+    assert shown == "Hello world"
+    assert result["model"] == "hedge-model"
+    assert result["hedged"] is True
+
+
+def stalled_stream(aborted: threading.Event, deltas: list = ()):
+    """Stub stream that yields `deltas`, then blocks like a stalled HTTP read until it is aborted."""
+    instruct.register_stream_abort(aborted.set)
+    yield from deltas
+    aborted.wait(5)
+    raise ConnectionError("stream aborted")
+
+
+def finished_stream(delta: str, result: dict):
+    yield delta
+    return result
+
+
+def test_hedged_stream_aborts_stalled_loser(monkeypatch):
+    aborted = threading.Event()
+
+    def stream_continued_query(system_message, user_message, llm_model, *args, **kwargs):
+        if llm_model == "primary-model":
+            return stalled_stream(aborted)
+        return finished_stream("fast", {"text": "fast", "stop_reason": "end_turn", "usage": {}, "rounds": 1})
+
+    monkeypatch.setattr(instruct, "stream_continued_query", stream_continued_query)
+    stream = instruct.stream_hedged_query("system", "user", "primary-model", "hedge-model", hedge_delay=0.05)
+    deltas = list(stream)
+    assert deltas == ["fast"]
+    assert aborted.wait(1)
+
+
+def test_hedged_stream_aborts_when_abandoned(monkeypatch):
+    aborted = threading.Event()
+    monkeypatch.setattr(instruct, "stream_continued_query", lambda *args, **kwargs: stalled_stream(aborted, ["partial"]))
+    stream = instruct.stream_hedged_query("system", "user", "primary-model", "hedge-model", hedge_delay=60)
+    assert next(stream) == "partial"
+    stream.close()
+    assert aborted.wait(1)
+
+
+class StubBatchTransport:
+    """In-memory batch endpoint: still processing for `polls` status calls, then ended."""
+
+    def __init__(self, polls: int, answer):
+        self.polls = polls
+        self.answer = answer
+        self.requests = None
+        self.status_calls = 0
+
+    def submit(self, requests: list) -> str:
+        self.requests = requests
+        return "batch-1"
+
+    def status(self, batch_id: str) -> dict:
+        assert batch_id == "batch-1"
+        self.status_calls += 1
+        ended = self.status_calls > self.polls
+        return {"id": batch_id, "processing_status": "ended" if ended else "in_progress"}
+
+    def results(self, batch: dict):
+        ## Providers return results in any order.
+        for request in reversed(self.requests):
+            yield {"custom_id": request["custom_id"], "result": self.answer(request)}
+
+
+def test_batch_maps_results_back_and_polls_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(instruct.time, "sleep", sleeps.append)
+
+    def answer(request):
+        prompt = request["params"]["messages"][0]["content"]
+        if prompt == "fail":
+            return {"type": "errored", "error": {"type": "overloaded_error"}}
+        if prompt == "expire":
+            return {"type": "expired"}
+        stop_reason = "max_tokens" if prompt == "long" else "end_turn"
+        return {
+            "type": "succeeded",
+            "message": {
+                "content": [{"type": "text", "text": f"re: {prompt}"}],
+                "stop_reason": stop_reason,
+                "usage": {"input_tokens": 5, "output_tokens": 7},
+            },
+        }
+
+    transport = StubBatchTransport(polls=3, answer=answer)
+    prompts = {"2401.00001": "short", "2401.00002": "long", "2401.00003": "fail", "2401.00004": "expire"}
+    results = instruct.run_instructor_batch(
+        "system", prompts, transport=transport, poll_interval=1, max_poll_interval=3
+    )
+
+    assert [r["custom_id"] for r in transport.requests] == ["req-0", "req-1", "req-2", "req-3"]
+    assert sleeps == [1, 2, 3]
+    assert results["2401.00001"] == {
+        "text": "re: short",
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 5, "output_tokens": 7},
+    }
+    assert results["2401.00002"]["stop_reason"] in instruct.truncated_stop_reasons
+    assert results["2401.00003"] == {"error": {"type": "overloaded_error"}}
+    assert results["2401.00004"] == {"error": "expired"}
+
+
+def test_batch_times_out(monkeypatch):
+    monkeypatch.setattr(instruct.time, "sleep", lambda seconds: None)
+    transport = StubBatchTransport(polls=10**6, answer=None)
+    with pytest.raises(TimeoutError):
+        instruct.run_instructor_batch("system", {"2401.00001": "short"}, transport=transport, timeout=0)
+
+
+class StubMessagesHandler(BaseHTTPRequestHandler):
+    """Answers Anthropic /v1/messages calls, recording the client port of each request."""
+
+    protocol_version = "HTTP/1.1"
+    ports = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.ports.append(self.client_address[1])
+        body = json.dumps(
+            {
+                "id": "msg_stub",
+                "type": "message",
+                "role": "assistant",
+                "model": "claude-3-haiku-20240307",
+                "content": [{"type": "text", "text": "stub answer"}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 3, "output_tokens": 2},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMessagesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubMessagesHandler.ports = []
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_clients_and_connections_are_reused(monkeypatch, stub_server):
+    pytest.importorskip("anthropic")
+    monkeypatch.setattr(instruct, "_clients", {})
+    monkeypatch.setattr(instruct, "_instructor_clients", {})
+    monkeypatch.setattr(lc, "llm_cache", None)
+    settings = {"base_url": stub_server, "api_key": "test", "max_retries": 0}
+    try:
+        client = instruct.get_client("Anthropic", **settings)
+        assert instruct.get_client("Anthropic", **settings) is client
+        assert instruct.get_client("Anthropic", **{**settings, "api_key": "other"}) is not client
+
+        for _ in range(3):
+            answer = instruct.run_instructor_query("system", "user", client_settings=settings)
+            assert answer == "stub answer"
+        ## One keep-alive connection served every call.
+        assert len(StubMessagesHandler.ports) == 3
+        assert len(set(StubMessagesHandler.ports)) == 1
+
+        pytest.importorskip("instructor")
+        patched = instruct.get_instructor_client(client)
+        assert instruct.get_instructor_client(client) is patched
+        assert patched is not instruct.get_instructor_client(instruct.get_client("Anthropic", **{**settings, "api_key": "other"}))
+    finally:
+        instruct.close_clients()
@@ -1,186 +1,611 @@
-from sqlalchemy import create_engine, text
-import streamlit as st
-import pandas as pd
-import psycopg2
+from sqlalchemy import text, table, column, insert
+from concurrent.futures import Future, CancelledError
+from contextlib import contextmanager
+from functools import lru_cache
+import threading
+import datetime
+import atexit
+import queue
+import time
 import re
 import os
 import uuid
 
-db_params = {}
-try:
-    db_params = {
-        "dbname": os.environ["DB_NAME"],
-        "user": os.environ["DB_USER"],
-        "password": os.environ["DB_PASS"],
-        "host": os.environ["DB_HOST"],
-        "port": os.environ["DB_PORT"],
-    }
-except:
-    db_params = {**st.secrets["postgres"]}
+import metrics as m
+from db import (
+    db_params,
+    pool_params,
+    get_engine,
+    get_pool_stats,
+    dashboard_codec,
+    dashboard_text_columns,
+    compress_text,
+    decompress_text,
+    decode_dashboard_fields,
+)
+from store import paper_store
 
 
-database_url = f"postgresql+psycopg2://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['dbname']}"
+arxiv_code_pattern = re.compile(r"arxiv:(\d{4}\.\d{4,5})")
 
 
+@lru_cache(maxsize=4096)
 def get_img_link_for_blob(text_blob: str):
     """Identify `arxiv_code from a text blob, and generate a Markdown link to its img."""
-    arxiv_code = re.findall(r"arxiv:(\d{4}\.\d{4,5})", text_blob)
-    if len(arxiv_code) == 0:
+    match = arxiv_code_pattern.search(text_blob)
+    if match is None:
         return None
-    arxiv_code = arxiv_code[0]
-    return f"https://llmpedia.s3.amazonaws.com/{arxiv_code}.png"
+    return f"https://llmpedia.s3.amazonaws.com/{match.group(1)}.png"
+
+
+title_catalog = {
+    "titles": {},
+    "high_water_mark": None,
+    "refreshed_at": 0.0,
+    "loaded_at": 0.0,
+}
+_title_catalog_lock = threading.Lock()
+title_catalog_ttl = int(os.environ.get("TITLE_CATALOG_TTL", 300))
+title_catalog_full_reload = int(os.environ.get("TITLE_CATALOG_FULL_RELOAD", 86400))
+
+
+@m.timer("utils.refresh_arxiv_title_catalog")
+def refresh_arxiv_title_catalog(full: bool = False) -> int:
+    """Fetch titles newer than the catalog's high-water mark (or all of them); returns rows fetched."""
+    with _title_catalog_lock:
+        hwm = None if full else title_catalog["high_water_mark"]
+        engine = get_engine()
+        with engine.connect() as conn:
+            query = text(
+                """
+                SELECT a.arxiv_code, a.title 
+                FROM arxiv_details a
+                WHERE a.title IS NOT NULL
+                AND (CAST(:hwm AS TEXT) IS NULL OR a.arxiv_code > :hwm)
+                """
+            )
+            rows = conn.execute(query, {"hwm": hwm}).fetchall()
+
+        ## Swap in a new dict so readers iterating the old one are unaffected.
+        titles = {} if hwm is None else dict(title_catalog["titles"])
+        titles.update({row[0]: row[1] for row in rows})
+        now = time.time()
+        title_catalog["titles"] = titles
+        title_catalog["high_water_mark"] = max(titles) if titles else None
+        title_catalog["refreshed_at"] = now
+        if hwm is None:
+            title_catalog["loaded_at"] = now
+    return len(rows)
 
 
 def get_arxiv_title_dict():
     """Get a list of all arxiv titles in the database."""
-    with psycopg2.connect(**db_params) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                f"""
-            SELECT a.arxiv_code, a.title 
-            FROM arxiv_details a
-            WHERE a.title IS NOT NULL
-            """
-            )
-            title_map = {row[0]: row[1] for row in cur.fetchall()}
-            return title_map
+    now = time.time()
+    if now - title_catalog["loaded_at"] > title_catalog_full_reload:
+        refresh_arxiv_title_catalog(full=True)
+    elif now - title_catalog["refreshed_at"] > title_catalog_ttl:
+        refresh_arxiv_title_catalog()
+    return title_catalog["titles"]
+
 
+def get_arxiv_title(arxiv_code: str):
+    """Look up a single title from the in-memory catalog, pulling new rows on a miss."""
+    title = get_arxiv_title_dict().get(arxiv_code)
+    if title is None:
+        refresh_arxiv_title_catalog()
+        title = title_catalog["titles"].get(arxiv_code)
+    return title
 
+
+@m.timer("utils.get_recursive_summary")
 def get_recursive_summary(arxiv_code: str) -> str:
     """Get recursive summary for a given arxiv code."""
-    engine = create_engine(database_url)
-    with engine.begin() as conn:
-        query = text(
-            f"""
-            SELECT arxiv_code, summary
-            FROM recursive_summaries
-            WHERE arxiv_code = '{arxiv_code}';
-            """
-        )
-        result = conn.execute(query)
-        summary = result.fetchone()
-    engine.dispose()
-    result = summary[1] if summary else None
-    return result
+    return paper_store.get_recursive_summary(arxiv_code)
 
 
+@m.timer("utils.get_extended_notes")
 def get_extended_notes(arxiv_code: str, level=None, expected_tokens=None):
     """Get extended summary for a given arxiv code."""
-    engine = create_engine(database_url)
-    with engine.begin() as conn:
-        if level:
-            query = text(
-                f"""
-                SELECT arxiv_code, level, summary
-                FROM summary_notes
-                WHERE arxiv_code = '{arxiv_code}'
-                AND level = '{level}';
-                """
-            )
-        elif expected_tokens:
-            query = text(
-                f"""
-                SELECT DISTINCT ON (arxiv_code) arxiv_code, level, summary, tokens
-                FROM summary_notes
-                WHERE arxiv_code = '{arxiv_code}'
-                ORDER BY arxiv_code, ABS(tokens - {expected_tokens}) ASC;
-                """
-            )
-        else:
-            query = text(
-                f"""
-                SELECT DISTINCT ON (arxiv_code) arxiv_code, level, summary
-                FROM summary_notes
-                WHERE arxiv_code = '{arxiv_code}'
-                ORDER BY arxiv_code, level DESC;
-                """
-            )
-        result = conn.execute(query)
-        summary = result.fetchone()
-    engine.dispose()
-    return summary[2]
+    notes = paper_store.get_notes(arxiv_code, level, expected_tokens)
+    return notes.summary if notes else None
 
 
-def log_request(arxiv_code: str) -> bool:
-    """Log Q&A in DB along with streamlit app state."""
+request_log_queue = queue.Queue(maxsize=int(os.environ.get("REQUEST_LOG_QUEUE_SIZE", 10000)))
+request_log_batch_size = int(os.environ.get("REQUEST_LOG_BATCH_SIZE", 100))
+request_log_flush_interval = float(os.environ.get("REQUEST_LOG_FLUSH_INTERVAL", 5))
+## Core insert, so SQLAlchemy batches executemany into multi-row VALUES (text() would send one INSERT per row).
+dashboard_requests_table = table("dashboard_requests", column("request_id"), column("tstp"), column("arxiv_code"))
+## Serializes batch writes between the background writer and explicit flushes.
+_request_log_lock = threading.Lock()
+_request_log_thread = None
+## Queued on shutdown to wake the writer and make it exit.
+_request_log_stop = object()
+
+
+@m.timer("utils.write_request_batch")
+def _write_request_batch(batch: list):
+    """Insert a batch of request log rows as multi-row INSERTs, counting written and failed rows."""
     try:
-        engine = create_engine(database_url)
-        with engine.begin() as conn:
-            request_id = str(uuid.uuid4())
-            tstp = pd.to_datetime("now").strftime("%Y-%m-%d %H:%M:%S")
-            query = text(
-                """
-                INSERT INTO dashboard_requests (request_id, tstp, arxiv_code)
-                VALUES (:request_id, :tstp, :arxiv_code)
-            """
-            )
-            conn.execute(
-                query,
-                {
-                    "request_id": request_id,
-                    "tstp": tstp,
-                    "arxiv_code": arxiv_code,
-                },
-            )
+        with _request_log_lock:
+            engine = get_engine()
+            with engine.begin() as conn:
+                conn.execute(insert(dashboard_requests_table), batch)
+        m.inc("request_log_rows_total", len(batch), result="written")
     except Exception as e:
-        print(f"Error in logging visit: {e}")
+        print(f"Error in logging visits: {e}")
+        m.inc("request_log_rows_total", len(batch), result="failed")
+
+
+def _drain_request_log(block: bool) -> tuple:
+    """Pull up to one batch from the queue, waiting up to the flush interval if `block`.
+
+    Returns (batch, stopped), where `stopped` means the shutdown marker was reached.
+    """
+    batch = []
+    deadline = time.time() + request_log_flush_interval
+    while len(batch) < request_log_batch_size:
+        try:
+            timeout = max(0.0, deadline - time.time()) if block else None
+            entry = request_log_queue.get(block=block, timeout=timeout)
+        except queue.Empty:
+            break
+        if entry is _request_log_stop:
+            return batch, True
+        batch.append(entry)
+    return batch, False
+
+
+def _request_log_worker():
+    stopped = False
+    while not stopped:
+        batch, stopped = _drain_request_log(block=True)
+        if batch:
+            _write_request_batch(batch)
+
+
+def flush_request_log():
+    """Write out everything queued so far, without waiting on the background writer."""
+    while True:
+        batch, _ = _drain_request_log(block=False)
+        if not batch:
+            break
+        _write_request_batch(batch)
+
+
+def _stop_request_log():
+    """Wake the background writer, wait for it to finish its batch, then flush the rest (at exit)."""
+    try:
+        request_log_queue.put(_request_log_stop, timeout=request_log_flush_interval)
+    except queue.Full:
+        pass
+    _request_log_thread.join(timeout=request_log_flush_interval)
+    flush_request_log()
+
+
+def log_request(arxiv_code: str) -> bool:
+    """Queue a request log entry for the background writer; returns False if it was dropped."""
+    global _request_log_thread
+    if _request_log_thread is None:
+        with _request_log_lock:
+            if _request_log_thread is None:
+                _request_log_thread = threading.Thread(
+                    target=_request_log_worker, name="request-log", daemon=True
+                )
+                _request_log_thread.start()
+                atexit.register(_stop_request_log)
+    entry = {
+        "request_id": str(uuid.uuid4()),
+        "tstp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "arxiv_code": arxiv_code,
+    }
+    try:
+        request_log_queue.put_nowait(entry)
+    except queue.Full:
+        m.inc("request_log_rows_total", result="dropped")
         return False
     return True
 
 
+@m.timer("utils.get_daily_arxiv_request_count")
 def get_daily_arxiv_request_count(date_str: str) -> int:
     """Get the number of requests for a given date."""
-    engine = create_engine(database_url)
+    engine = get_engine()
     with engine.begin() as conn:
         query = text(
-            f"""
+            """
             SELECT COUNT(DISTINCT arxiv_code)
             FROM arxiv_dashboards
-            WHERE tstp::date = '{date_str}';
+            WHERE tstp >= CAST(:date_str AS date)
+            AND tstp < CAST(:date_str AS date) + 1;
             """
         )
-        result = conn.execute(query)
+        result = conn.execute(query, {"date_str": date_str})
         count = result.fetchone()[0]
-    engine.dispose()
     return count
 
 
-def get_arxiv_dashboard_script(arxiv_code: str, sel_col: str = "script_content") -> str:
-    """Query DB to get script for the arxiv dashboard."""
-    engine = create_engine(database_url)
+@m.timer("utils.get_daily_generation_count")
+def get_daily_generation_count(date_str: str) -> int:
+    """Get the day's counter of interactive generations (0 before the first one).
+
+    Only `increment_daily_generation_count` moves it, so dashboards saved by the
+    pre-generation worker or the batch backfill do not use up the user quota.
+    """
+    engine = get_engine()
+    with engine.connect() as conn:
+        query = text("SELECT generations FROM dashboard_quota WHERE day = CAST(:date_str AS date);")
+        count = conn.execute(query, {"date_str": date_str}).scalar()
+    return count or 0
+
+
+@m.timer("utils.increment_daily_generation_count")
+def increment_daily_generation_count(date_str: str, limit: int):
+    """Atomically take one generation from the day's counter; returns the new count, or None if exhausted."""
+    engine = get_engine()
     with engine.begin() as conn:
         query = text(
-            f"""
-            SELECT {sel_col}
-            FROM arxiv_dashboards
-            WHERE arxiv_code = '{arxiv_code}';
+            """
+            INSERT INTO dashboard_quota (day, generations)
+            VALUES (CAST(:date_str AS date), 1)
+            ON CONFLICT (day) DO UPDATE
+            SET generations = dashboard_quota.generations + 1
+            WHERE dashboard_quota.generations < :limit
+            RETURNING generations;
             """
         )
-        result = conn.execute(query)
-        row = result.fetchone()
-        script = row[0] if row else None
-    engine.dispose()
-    return script
+        count = conn.execute(query, {"date_str": date_str, "limit": limit}).scalar()
+    return count
 
-def save_arxiv_dashboard_script(arxiv_code: str, summary:str, scratchpad:str, script:str) -> bool:
-    """Insert a new arxiv dashboard script into the DB."""
-    engine = create_engine(database_url)
-    tstp = pd.to_datetime("now").strftime("%Y-%m-%d %H:%M:%S")
+
+@m.timer("utils.get_arxiv_dashboard_script")
+def get_arxiv_dashboard_script(arxiv_code: str, sel_col: str = "script_content") -> str:
+    """Query DB to get script for the arxiv dashboard's current version."""
+    return paper_store.get_dashboard_field(arxiv_code, sel_col)
+
+
+@m.timer("utils.get_dashboard_version")
+def get_dashboard_version(arxiv_code: str) -> str:
+    """Get the "<version>:<tstp>" tag of a paper's current dashboard (a primary-key lookup), or None."""
+    return paper_store.get_dashboard_version(arxiv_code)
+
+
+def _dashboard_row(arxiv_code: str, summary: str, scratchpad: str, script: str) -> dict:
+    """Build insert parameters for a dashboard, compressed with the configured codec."""
+    fields = {"script_content": script, "summary": summary, "scratchpad": scratchpad}
+    row = {"arxiv_code": arxiv_code, "codec": None}
+    row.update({col: fields[col] for col in dashboard_text_columns})
+    row.update({f"{col}_z": None for col in dashboard_text_columns})
+    if dashboard_codec != "none":
+        row["codec"] = dashboard_codec
+        row.update({col: None for col in dashboard_text_columns})
+        row.update({f"{col}_z": compress_text(fields[col], dashboard_codec) for col in dashboard_text_columns})
+    return row
+
+
+dashboard_row_types = {
+    "arxiv_code": "text",
+    "codec": "text",
+    **{col: "text" for col in dashboard_text_columns},
+    **{f"{col}_z": "bytea" for col in dashboard_text_columns},
+}
+dashboard_save_batch_size = int(os.environ.get("DASHBOARD_SAVE_BATCH_SIZE", 100))
+
+
+def _save_dashboard_rows(conn, rows: list, tstp: str):
+    """Save dashboard rows as new current versions in one multi-row statement."""
+    columns = list(dashboard_row_types)
+    values = ",\n".join(
+        "(" + ", ".join(f"CAST(:{col}_{i} AS {dashboard_row_types[col]})" for col in columns) + ")"
+        for i in range(len(rows))
+    )
+    params = {f"{col}_{i}": row[col] for i, row in enumerate(rows) for col in columns}
+    params["tstp"] = tstp
+    ## Bumping the pointer rows allocates the versions and serializes concurrent saves of a paper.
+    query = text(
+        f"""
+        WITH new ({", ".join(columns)}) AS (
+            VALUES {values}
+        ),
+        current AS (
+            INSERT INTO arxiv_dashboard_current (arxiv_code, version, tstp)
+            SELECT arxiv_code, 1, CAST(:tstp AS timestamp) FROM new
+            ON CONFLICT (arxiv_code) DO UPDATE
+            SET version = arxiv_dashboard_current.version + 1, tstp = EXCLUDED.tstp
+            RETURNING arxiv_code, version
+        )
+        INSERT INTO arxiv_dashboards (arxiv_code, version, tstp, {", ".join(columns[1:])})
+        SELECT new.arxiv_code, current.version, CAST(:tstp AS timestamp), {", ".join(f"new.{col}" for col in columns[1:])}
+        FROM new
+        JOIN current ON current.arxiv_code = new.arxiv_code
+        """
+    )
+    conn.execute(query, params)
+
+
+@m.timer("utils.save_arxiv_dashboard_scripts")
+def save_arxiv_dashboard_scripts(dashboards: list) -> int:
+    """Save many dashboards (dicts with arxiv_code, summary, scratchpad and script) as new current versions.
+
+    Rows are written DASHBOARD_SAVE_BATCH_SIZE at a time as multi-row statements, in one
+    transaction. A paper listed twice keeps its last dashboard.
+    """
+    ## One statement cannot bump the same pointer row twice, so dedupe by paper first.
+    latest = {d["arxiv_code"]: d for d in dashboards}
+    rows = [_dashboard_row(code, d["summary"], d.get("scratchpad", ""), d["script"]) for code, d in latest.items()]
+    if not rows:
+        return 0
+    engine = get_engine()
+    tstp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with engine.begin() as conn:
+        for i in range(0, len(rows), dashboard_save_batch_size):
+            _save_dashboard_rows(conn, rows[i : i + dashboard_save_batch_size], tstp)
+    return len(rows)
+
+
+@m.timer("utils.save_arxiv_dashboard_script")
+def save_arxiv_dashboard_script(arxiv_code: str, summary:str, scratchpad:str, script:str) -> bool:
+    """Save an arxiv dashboard script to the DB as the paper's new current version."""
+    dashboard = {"arxiv_code": arxiv_code, "summary": summary, "scratchpad": scratchpad, "script": script}
+    return save_arxiv_dashboard_scripts([dashboard]) == 1
+
+
+@m.timer("utils.load_paper_contexts")
+def load_paper_contexts(arxiv_codes: list, expected_tokens: int = 3000, note_levels: dict = None) -> dict:
+    """Load title, summaries, best-fit notes and cached dashboard for many papers in one query.
+
+    Papers in `note_levels` get that note level; others get the note closest to `expected_tokens`.
+    """
+    return paper_store.load_paper_contexts(arxiv_codes, expected_tokens, note_levels)
+
+
+def load_paper_context(arxiv_code: str, expected_tokens: int = 3000, note_level=None) -> dict:
+    """Load everything the Generate path needs for a paper in a single round trip."""
+    note_levels = {arxiv_code: note_level} if note_level is not None else None
+    return load_paper_contexts([arxiv_code], expected_tokens, note_levels).get(arxiv_code)
+
+
+note_index = {
+    "levels": {},
+    "high_water_mark": None,
+    "refreshed_at": 0.0,
+    "loaded_at": 0.0,
+}
+_note_index_lock = threading.Lock()
+note_index_ttl = int(os.environ.get("NOTE_INDEX_TTL", 300))
+note_index_full_reload = int(os.environ.get("NOTE_INDEX_FULL_RELOAD", 86400))
+
+
+@m.timer("utils.refresh_note_index")
+def refresh_note_index(full: bool = False) -> int:
+    """Fetch (level, tokens) for notes of papers above the index's high-water mark (or all); returns rows fetched."""
+    with _note_index_lock:
+        hwm = None if full else note_index["high_water_mark"]
+        engine = get_engine()
+        with engine.connect() as conn:
+            query = text(
+                """
+                SELECT arxiv_code, level, tokens
+                FROM summary_notes
+                WHERE tokens IS NOT NULL
+                AND (CAST(:hwm AS TEXT) IS NULL OR arxiv_code > :hwm)
+                """
+            )
+            rows = conn.execute(query, {"hwm": hwm}).fetchall()
+
+        levels = {} if hwm is None else dict(note_index["levels"])
+        for arxiv_code, level, tokens in rows:
+            levels[arxiv_code] = sorted([*levels.get(arxiv_code, []), (tokens, level)])
+        now = time.time()
+        note_index["levels"] = levels
+        note_index["high_water_mark"] = max(levels) if levels else None
+        note_index["refreshed_at"] = now
+        if hwm is None:
+            note_index["loaded_at"] = now
+    return len(rows)
+
+
+_note_index_refreshing = threading.Lock()
+
+
+def refresh_note_index_async(full: bool = False):
+    """Refresh the note index on a background thread, unless a refresh is already running."""
+    if not _note_index_refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_note_index(full)
+        except Exception as e:
+            print(f"Error in refreshing the note index: {e}")
+        finally:
+            _note_index_refreshing.release()
+
+    threading.Thread(target=run, name="note-index-refresh", daemon=True).start()
+
+
+def get_note_levels(arxiv_code: str) -> list:
+    """Get a paper's available (tokens, level) notes, sorted by size, from memory only.
+
+    Stale indexes and unknown papers are refreshed in the background, so a miss
+    returns [] and the caller falls back to its token budget.
+    """
+    now = time.time()
+    if now - note_index["loaded_at"] > note_index_full_reload:
+        refresh_note_index_async(full=True)
+    elif now - note_index["refreshed_at"] > note_index_ttl:
+        refresh_note_index_async()
+    levels = note_index["levels"].get(arxiv_code)
+    if levels is None:
+        refresh_note_index_async()
+        return []
+    return levels
+
+
+def select_note_level(arxiv_code: str, token_budget: int):
+    """Pick the largest note level that fits the token budget (or the smallest one if none fit)."""
+    levels = get_note_levels(arxiv_code)
+    if not levels:
+        return None
+    fitting = [level for tokens, level in levels if tokens <= token_budget]
+    return fitting[-1] if fitting else levels[0][1]
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+single_flight_timeout = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", 300))
+
+
+def single_flight(key: str, fn, on_follow=None, timeout: float = single_flight_timeout):
+    """Run `fn` once per key among concurrent callers; followers wait up to `timeout` for the leader's result.
+
+    If the leader is interrupted without an error (e.g. a Streamlit rerun or stop),
+    its followers retry, and one of them takes over.
+    """
+    while True:
+        with _inflight_lock:
+            future = _inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                _inflight[key] = future
+        if is_leader:
+            break
+        if on_follow:
+            on_follow()
+        try:
+            return future.result(timeout=timeout)
+        except CancelledError:
+            continue
+    ## The key is released before the future resolves, so woken followers never see a finished leader.
+    try:
+        result = fn()
+    except BaseException as e:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        if isinstance(e, Exception):
+            future.set_exception(e)
+        else:
+            future.cancel()
+        raise
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    future.set_result(result)
+    return result
+
+
+@contextmanager
+def dashboard_generation_lock(arxiv_code: str):
+    """Try to take a cross-replica advisory lock on a paper's generation; yields whether it was acquired."""
+    engine = get_engine()
+    params = {"key": f"arxiv_dashboards:{arxiv_code}"}
+    with engine.connect() as conn:
+        acquired = conn.execute(
+            text("SELECT pg_try_advisory_lock(hashtext(:key));"), params
+        ).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key));"), params)
+                conn.commit()
+
+
+@m.timer("utils.wait_for_dashboard")
+def wait_for_dashboard(arxiv_code: str, timeout: float = 180, interval: float = 2):
+    """Poll until another replica saves a paper's dashboard; returns (summary, script) or None."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        script = get_arxiv_dashboard_script(arxiv_code, "script_content")
+        if script:
+            return get_arxiv_dashboard_script(arxiv_code, "summary"), script
+        time.sleep(interval)
+    return None
+
+
+@m.timer("utils.get_pregeneration_candidates")
+def get_pregeneration_candidates(days: int = 7, limit: int = 100) -> list:
+    """Rank papers without a dashboard by recent request volume, then by recency."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        query = text(
+            """
+            SELECT a.arxiv_code, COALESCE(r.n_requests, 0) AS n_requests
+            FROM arxiv_details a
+            LEFT JOIN (
+                SELECT arxiv_code, COUNT(*) AS n_requests
+                FROM dashboard_requests
+                WHERE tstp >= NOW() - make_interval(days => :days)
+                GROUP BY arxiv_code
+            ) r ON r.arxiv_code = a.arxiv_code
+            WHERE a.title IS NOT NULL
+            AND EXISTS (SELECT 1 FROM summary_notes s WHERE s.arxiv_code = a.arxiv_code)
+            AND NOT EXISTS (SELECT 1 FROM arxiv_dashboard_current c WHERE c.arxiv_code = a.arxiv_code)
+            ORDER BY n_requests DESC, a.arxiv_code DESC
+            LIMIT :limit;
+            """
+        )
+        result = conn.execute(query, {"days": days, "limit": limit})
+        candidates = [(row.arxiv_code, row.n_requests) for row in result]
+    return candidates
+
+
+@m.timer("utils.get_all_dashboard_scripts")
+def get_all_dashboard_scripts() -> list:
+    """Get the script content of every paper's current dashboard."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        query = text(
+            """
+            SELECT d.codec, d.script_content, d.script_content_z
+            FROM arxiv_dashboard_current c
+            JOIN arxiv_dashboards d ON d.arxiv_code = c.arxiv_code AND d.version = c.version;
+            """
+        )
+        scripts = [
+            decode_dashboard_fields(codec, {"script": plain}, {"script": blob})["script"]
+            for codec, plain, blob in conn.execute(query)
+        ]
+    return [script for script in scripts if script]
+
+
+@m.timer("utils.get_dashboard_versions")
+def get_dashboard_versions() -> dict:
+    """Get {arxiv_code: (current version's tstp, title)} for every stored dashboard, without loading content."""
+    engine = get_engine()
+    with engine.connect() as conn:
         query = text(
             """
-            INSERT INTO arxiv_dashboards (arxiv_code, tstp, script_content, summary, scratchpad)
-            VALUES (:arxiv_code, :tstp, :script_content, :summary, :scratchpad)
+            SELECT c.arxiv_code, c.tstp, a.title
+            FROM arxiv_dashboard_current c
+            LEFT JOIN arxiv_details a ON a.arxiv_code = c.arxiv_code;
             """
         )
-        conn.execute(
-            query,
-            {
-                "arxiv_code": arxiv_code,
-                "tstp": tstp,
-                "script_content": script,
-                "summary": summary,
-                "scratchpad": scratchpad,
-            },
+        versions = {row.arxiv_code: (str(row.tstp), row.title) for row in conn.execute(query)}
+    return versions
+
+
+@m.timer("utils.load_dashboards")
+def load_dashboards(arxiv_codes: list) -> dict:
+    """Load the current decoded dashboard (title, summary, script, tstp) for many papers in one query."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        query = text(
+            """
+            SELECT d.arxiv_code, d.tstp, a.title, d.codec,
+                   d.summary, d.script_content, d.summary_z, d.script_content_z
+            FROM arxiv_dashboard_current c
+            JOIN arxiv_dashboards d ON d.arxiv_code = c.arxiv_code AND d.version = c.version
+            LEFT JOIN arxiv_details a ON a.arxiv_code = c.arxiv_code
+            WHERE c.arxiv_code = ANY(:arxiv_codes);
+            """
         )
-        return True
\ No newline at end of file
+        dashboards = {}
+        for row in conn.execute(query, {"arxiv_codes": list(arxiv_codes)}):
+            fields = decode_dashboard_fields(
+                row.codec,
+                {"summary": row.summary, "script_content": row.script_content},
+                {"summary": row.summary_z, "script_content": row.script_content_z},
+            )
+            dashboards[row.arxiv_code] = {"tstp": str(row.tstp), "title": row.title, **fields}
+    return dashboards